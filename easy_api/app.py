@@ -8,7 +8,7 @@ import uvloop
 from tornado.options import define, options
 
 from easy_api import application, celery, configs
-from easy_api.service import celery_waiter
+from easy_api.service import celery_waiter, db, publisher, task
 from easy_api.schema import swagger
 
 define("config", default="./config.yaml", help="config file path")
@@ -26,7 +26,10 @@ def start_app():
     celery.install()
     handlers = application.get_handlers()
     app = tornado.web.Application(handlers)
+    # the tasks may choose celery by run_in_worker whatever the default executor is,
+    # the waiter does not connect to the backend until a result is waited
     celery_waiter.install()
+    db.install()
 
     if logging.DEBUG >= logging.root.level:
         for handler in handlers:
@@ -42,7 +45,12 @@ def start_app():
 
     # loop = asyncio.get_event_loop()
     # loop.set_debug(True)
-    tornado.ioloop.IOLoop.current().start()
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    finally:
+        publisher.publisher.stop()
+        task.shutdown_executors()
+        tornado.ioloop.IOLoop.current().run_sync(db.close_pools)
 
 
 if __name__ == "__main__":
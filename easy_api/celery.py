@@ -1,7 +1,8 @@
 from celery import Celery, signals
 from click import Option
+from kombu import Queue
 
-from easy_api import configs
+from easy_api import configs, tasks
 
 app = Celery('tasks')
 app.user_options['preload'].add(Option(('-C', '--config'),
@@ -9,8 +10,59 @@ app.user_options['preload'].add(Option(('-C', '--config'),
                                        help='special easy_api config file'))
 
 
+# the queue of the tasks without route
+DEFAULT_QUEUE = "celery"
+# the priority levels of the config, 0 is the highest
+PRIORITY_STEPS = list(range(10))
+AMQP_TRANSPORTS = ("amqp", "amqps", "pyamqp", "librabbitmq")
+REDIS_TRANSPORTS = ("redis", "rediss", "sentinel")
+
+
+def get_transport() -> str:
+    return configs.celery.broker.split("://", 1)[0].split("+")[0]
+
+
+def get_priority(priority: int) -> int:
+    """ the priority of the config to the broker, rabbitmq serves the larger number first, redis the smaller """
+    return PRIORITY_STEPS[-1] - priority if get_transport() in AMQP_TRANSPORTS else priority
+
+
+def get_route(package_name: str, task_name: str) -> dict:
+    """ the route of task, the options of package.task override the options of package """
+    routes = configs.celery.routes
+    return {**(routes.get(package_name) or {}), **(routes.get(f"{package_name}.{task_name}") or {})}
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """ route invoke_task to the queue of its package and task """
+    if name != tasks.invoke_task.name or len(args) < 2:
+        return None
+    route = get_route(args[0], args[1])
+    if route.get("priority") is not None:
+        route["priority"] = get_priority(route["priority"])
+    return route or None
+
+
+def get_task_queues() -> list:
+    queues = {x["queue"] for x in configs.celery.routes.values() if x.get("queue")}
+    queues.discard(DEFAULT_QUEUE)
+    # the routed queues support priority in amqp, the default queue keeps its arguments as before
+    return [Queue(DEFAULT_QUEUE)] + [Queue(x, queue_arguments={"x-max-priority": len(PRIORITY_STEPS)})
+                                     for x in sorted(queues)]
+
+
+def get_transport_options() -> dict:
+    if get_transport() in REDIS_TRANSPORTS:
+        return {"priority_steps": PRIORITY_STEPS, "queue_order_strategy": "priority"}
+    return {}
+
+
 def update_celery_conf():
     app.conf.update(
+        task_routes=(route_task,),
+        task_queues=get_task_queues(),
+        task_default_queue=DEFAULT_QUEUE,
+        broker_transport_options=get_transport_options(),
         broker_url=configs.celery.broker,
         result_backend=configs.celery.backend,
         task_serializer=configs.celery.serializer,
@@ -33,6 +85,12 @@ def on_preload_parsed(options, **kwargs):
     app.autodiscover_tasks(configs.server.apps)
 
 
+@signals.worker_init.connect
+def on_worker_init(**kwargs):
+    # import the tasks before the pool processes are forked, so they are warm before accepting jobs
+    tasks.load_registry()
+
+
 def install():
     # there is start easy_api server with celery
     update_celery_conf()
@@ -1,8 +1,8 @@
 import logging
 import os
 import sys
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import Dict, List
 
 import yaml
 
@@ -31,6 +31,21 @@ class DatabaseCell:
     user: str = ""
     password: str = ""
     charset: str = ""
+    # connection pool, the pool is created once per alias and reused by every query
+    pool_minsize: int = 1
+    pool_maxsize: int = 10
+    # close the idle connection after seconds, -1 means never recycle
+    pool_recycle: int = 3600
+    # ping the connection before use if it has been idle for seconds, 0 means never ping
+    pool_ping_interval: int = 30
+    # the read only statements are sent to the replicas, the others are sent to this primary
+    replicas: List["DatabaseCell"] = field(default_factory=list)
+    # round_robin or least_outstanding
+    replica_strategy: str = "round_robin"
+    # exclude the replica which lags behind the primary more than seconds, 0 means never check lag
+    replica_max_lag: int = 0
+    # check the health and lag of replicas every seconds
+    replica_check_interval: int = 10
 
 
 @dataclass(eq=False, frozen=True)
@@ -46,6 +61,36 @@ class Celery:
     backend: str
     serializer: str
     timezone: str
+    # poll the results of the waited tasks every seconds when the backend is not redis
+    result_poll_interval: float = 0.5
+    # the default seconds to wait the result of run_in_worker, 0 means never timeout,
+    # it is the hard time limit of task by default, the result never arrives after that
+    task_timeout: float = 11 * 60
+    # the queue and priority of python tasks, the key is package or package.task, the latter overrides the former,
+    # like {"report": {"queue": "slow"}, "report.daily": {"queue": "slow", "priority": 0}}
+    routes: Dict[str, dict] = field(default_factory=dict)
+    # the side store of large payloads, file:///shared/dir or redis://, empty means always in the broker message
+    payload_store: str = ""
+    # the arguments and results larger than bytes are passed by reference through the side store
+    payload_threshold: int = 1024 * 1024
+
+
+@dataclass(eq=False, frozen=True)
+class Cache:
+    """ This is about cache """
+    # memory:// is the in-memory LRU of each process, or shared backend url of aiocache like redis://localhost:6379/1
+    url: str = "memory://"
+    # the max number of items in the in-memory LRU
+    maxsize: int = 1024
+
+
+@dataclass(eq=False, frozen=True)
+class Executor:
+    """ This is about the executor of run_in_worker """
+    # celery sends the task to worker, process or thread runs the task in a local pool without broker
+    backend: str = "celery"
+    # the max workers of the local pool, 0 means the number of cpus
+    max_workers: int = 0
 
 
 @dataclass(eq=False, frozen=True)
@@ -63,6 +108,20 @@ server: Server
 celery: Celery
 database: Database
 swagger: Swagger
+cache: Cache
+executor: Executor
+# the absolute path of loaded config file
+config_file: str = None
+
+
+def get_database_cell(instance: dict) -> DatabaseCell:
+    """ the replica inherits the options of its primary, so it only needs to provide the different ones """
+    replicas = instance.pop("replicas", None) or []
+    instance["replicas"] = [
+        DatabaseCell(**{**instance, "replicas": [], "name": f'{instance["name"]}:replica{i}', **replica})
+        for i, replica in enumerate(replicas)
+    ]
+    return DatabaseCell(**instance)
 
 
 def install(config_path: str = None):
@@ -74,12 +133,15 @@ def install(config_path: str = None):
     with open(_config_path, 'r') as file:
         configs = yaml.safe_load(file)
 
-    global server, celery, database, swagger
+    global server, celery, database, swagger, cache, executor, config_file
+    config_file = _config_path
     server = Server(**configs["server"])
     swagger = Swagger(**configs["swagger"])
     celery = Celery(**configs["celery"])
+    cache = Cache(**configs.get("cache") or {})
+    executor = Executor(**configs.get("executor") or {})
     configs["database"]["instances"] = [
-        DatabaseCell(**instance) for instance
+        get_database_cell(instance) for instance
         in configs["database"]["instances"]
     ]
     database = Database(**configs["database"])
@@ -40,6 +40,7 @@ SQLNotFoundError = e("SQLNotFoundError", 9898, "SQL not found")
 
 # task errors, error number start at 9699
 TaskExistsError = e("TaskExistsError", 9699, "Task already exists")
+TaskTimeoutError = e("TaskTimeoutError", 9698, "Task {task_name} timeout after {timeout} seconds")
 
 # group errors, error number start at 9599
 GroupExistsError = e("GroupExistsError", 9599, "Group already exists")
\ No newline at end of file
@@ -12,6 +12,7 @@ logger = logging.getLogger("easy_api.handler.group")
 
 @api(r'/pipeline')
 class PipelineHandler(Handler, ABC):
+    cancel_on_close = True
 
     @response_schema(Result)
     @request_schema('data', schema=PipelineRequestSchema)
@@ -21,5 +22,11 @@ class PipelineHandler(Handler, ABC):
         tags: [Easy API]
         summary: create a pipeline
         """
-        result = await pipeline.run(data.tasks)
+        trace = [] if data.trace else None
+        try:
+            result = await pipeline.run(data.tasks, concurrency=data.concurrency, trace=trace)
+        except ValueError as e:
+            return Result.failre(str(e))
+        if trace is not None:
+            return Result.success({"output": result, "trace": trace})
         return Result.success(result)
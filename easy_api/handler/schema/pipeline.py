@@ -1,9 +1,34 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional
 
 from dataclasses_jsonschema import JsonSchemaMixin
 
 
+@dataclass
+class StreamSchema(JsonSchemaMixin):
+    """ The sql service which feeds its rows to the task in chunks """
+    package_name: str = field(metadata={"description": "The package name of sql"})
+    name: str = field(metadata={"description": "The sql name"})
+    kwargs: dict = field(metadata={"description": "The params will be pass to the sql, like {\"data\": {}}"},
+                         default_factory=dict)
+    batch_size: int = field(metadata={"description": "The number of rows in each chunk"}, default=1000)
+    concurrency: int = field(metadata={"description": "The max number of chunks processed at the same time, "
+                                                     "the rows are not read until a chunk is finished"}, default=4)
+    argument: str = field(metadata={"description": "The argument name of the task which receives the rows"},
+                          default="rows")
+
+
+@dataclass
+class MapSchema(JsonSchemaMixin):
+    """ The list in context which the task is called for each item of """
+    items: str = field(metadata={"description": "The list to fan out, jinja2 template syntax, like {{ rows }}"})
+    batch_size: int = field(metadata={"description": "The number of items in each call, the argument is the item "
+                                                    "itself if it is 1, otherwise the list of items"}, default=1)
+    concurrency: int = field(metadata={"description": "The max number of calls at the same time"}, default=4)
+    argument: str = field(metadata={"description": "The argument name of the task which receives the items"},
+                          default="item")
+
+
 @dataclass
 class TaskSchema(JsonSchemaMixin):
     """ Task Schema """
@@ -13,6 +38,21 @@ class TaskSchema(JsonSchemaMixin):
     output: dict = field(metadata={"description": "The output of the task"})
     condition: str = field(metadata={"description": "The condition of task, jinja2 template syntax"}, default="")
     layer: int = field(metadata={"description": "Synchronous execution in layer order"}, default=0)
+    id: str = field(metadata={"description": "The id of task referred by depends, default is its index in tasks"},
+                    default="")
+    depends: Optional[List[str]] = field(
+        metadata={"description": "The ids of tasks whose outputs are the inputs of this task, the task starts once "
+                                 "they are finished. If it is not provided, the task depends on the tasks of "
+                                 "previous layer"},
+        default=None)
+    stream: Optional[StreamSchema] = field(
+        metadata={"description": "Stream the rows of sql to the task chunk by chunk, the task is called once per "
+                                 "chunk and its result data is the list of the data of chunks"},
+        default=None)
+    map: Optional[MapSchema] = field(
+        metadata={"description": "Call the task for each item of a list in context, the result data is the list "
+                                 "of the data of calls in the order of items"},
+        default=None)
 
 
 @dataclass
@@ -20,3 +60,7 @@ class PipelineRequestSchema(JsonSchemaMixin):
     """ The request schema for group """
     tasks: List[TaskSchema]
     version: str = field(metadata={"description": "The version of the pipeline"}, default="v1")
+    concurrency: int = field(metadata={"description": "The max number of tasks running at the same time, "
+                                                     "0 means no limit"}, default=0)
+    trace: bool = field(metadata={"description": "Return the timeline of each task with the output, "
+                                               "the data is {\"output\": {}, \"trace\": []}"}, default=False)
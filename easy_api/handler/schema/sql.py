@@ -18,4 +18,24 @@ class SQLRequestSchema(JsonSchemaMixin):
                                  "or content from provided string, default is false."})
     export_xlsx: Union[bool, str] = field(
         default=False,
-        metadata={"description": "support export to xlsx"})
+        metadata={"description": "support export to xlsx, csv and ndjson, "
+                                 "if provided string, it is the header of export file like field1:title1,field2:title2"})
+    stream: bool = field(
+        default=False,
+        metadata={"description": "write the rows to response by chunks, it is suitable for large result"})
+    cache_ttl: int = field(
+        default=0,
+        metadata={"description": "cache the result for seconds, the cache is invalid once its tables are written, "
+                                 "0 means no cache"})
+    keyset: str = field(
+        default="",
+        metadata={"description": "the ordering columns of pagination like id or created_at desc,id desc, "
+                                 "if provided, the next page is sought by the next_cursor of result instead of offset, "
+                                 "so the deep page costs the same as the first one"})
+    count_mode: str = field(
+        default="exact",
+        metadata={"description": "how to count the rows of pagination, exact, estimate by the query plan of mysql, "
+                                 "or none to skip count, the count is -1 and has_more tells whether there is a next page"})
+    count_ttl: int = field(
+        default=0,
+        metadata={"description": "cache the count of the same filter parameters for seconds, 0 means no cache"})
@@ -23,10 +23,12 @@ class CreateSQLHandler(Handler, ABC):
         try:
             if data.count_sql is False:
                 await create_sql(package_name, sql_name, data.nickname, sql_jinja=jinja_sql, overwrite=overwrite,
-                                 method=data.method, export_xlsx=data.export_xlsx)
+                                 method=data.method, export_xlsx=data.export_xlsx, stream=data.stream,
+                                 cache_ttl=data.cache_ttl)
             else:
                 await create_pagination_sql(package_name, sql_name, data.nickname, sql_jinja=jinja_sql, count_jinja=data.count_sql,
-                                            overwrite=overwrite)
+                                            overwrite=overwrite, keyset=data.keyset, count_mode=data.count_mode,
+                                            count_ttl=data.count_ttl)
             return Result.success("ok")
         except Exception as e:
             logger.exception("create sql error")
@@ -0,0 +1,29 @@
+from abc import ABC
+
+from easy_api import tasks
+from easy_api.handler import api
+from easy_api.schema import Result, response_schema
+from easy_api.service import cache, celery_waiter, db, payload, publisher, task
+from easy_api.web import Handler
+
+
+@api(r'/stats')
+class StatsHandler(Handler, ABC):
+
+    @response_schema(Result)
+    async def get(self) -> Result:
+        """ Get the runtime stats.
+        ---
+        tags: [Easy API]
+        summary: get the runtime stats of this process, such as the counters of query cache and coalesce
+        """
+        return Result.success({
+            "query_cache": dict(cache.stats),
+            "query_coalesce": db.query_flight.stats(),
+            "replicas": db.replica_stats(),
+            "celery_waiter": celery_waiter.get_stats(),
+            "publisher": publisher.publisher.stats(),
+            "task_registry": tasks.get_registry_stats(),
+            "task_cache": task.get_task_cache_stats(),
+            "payload": dict(payload.stats),
+        })
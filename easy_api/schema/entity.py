@@ -51,10 +51,12 @@ class PagingResult(JsonSchemaMixin):
     msg: str = ""
     data: Union[dict, list, str, int] = None
     count: int = 0
+    next_cursor: str = None
+    has_more: bool = None
 
     @classmethod
-    def success(cls, data: Union[dict, list, str], count: int):
-        return cls(code=0, data=data, count=count)
+    def success(cls, data: Union[dict, list, str], count: int, next_cursor: str = None, has_more: bool = None):
+        return cls(code=0, data=data, count=count, next_cursor=next_cursor, has_more=has_more)
 
     @classmethod
     def error(cls, error: Exception, code: int = -1):
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from aiocache import Cache
+from aiocache.serializers import PickleSerializer
+
+from easy_api import configs
+
+logger = logging.getLogger("easy_api.cache")
+
+# match the tables after from, join, into, update and delete from, the tables after from may be a comma list
+# like "from a, b as c", the alias of a table is not a keyword which starts the next clause
+_table = r"[`\"\[]?[\w.]+[`\"\]]?"
+_alias = r"(?:\s+(?:as\s+)?(?!(?:where|join|left|right|inner|outer|cross|full|natural|straight_join|on|using|group|" \
+         r"order|limit|union|having|set|values|select|window|for|lock|into)\b)\w+)?"
+table_pattern = re.compile(rf"\b(?:from|join|into|update|table)\s+({_table}{_alias}(?:\s*,\s*{_table}{_alias})*)",
+                           re.IGNORECASE)
+
+stats = {
+    "hits": 0,
+    "misses": 0,
+    "invalidations": 0,
+}
+
+
+class MemoryBackend:
+    """
+    In-memory LRU backend, the table versions are kept out of the LRU,
+    so they are never evicted before the cached results.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._counters: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expire_at = item
+        if expire_at and expire_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: int = None):
+        self._data[key] = (value, time.monotonic() + ttl if ttl else 0)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+        self._counters.pop(key, None)
+
+    async def multi_get(self, keys: List[str], loads_fn: Callable[[Any], Any] = None) -> List[Optional[int]]:
+        values = [self._counters.get(x) for x in keys]
+        return [loads_fn(x) for x in values] if loads_fn else values
+
+    async def increment(self, key: str, delta: int = 1) -> int:
+        self._counters[key] = self._counters.get(key, 0) + delta
+        return self._counters[key]
+
+    async def clear(self):
+        self._data.clear()
+        self._counters.clear()
+
+
+_backend = None
+
+
+def get_backend():
+    """ get the cache backend from config, memory:// is the in-memory LRU, others are shared by aiocache """
+    global _backend
+    if _backend is None:
+        if configs.cache.url.startswith("memory://"):
+            _backend = MemoryBackend(configs.cache.maxsize)
+        else:
+            _backend = Cache.from_url(configs.cache.url)
+            _backend.serializer = PickleSerializer()
+        logger.debug("use cache backend: %s", configs.cache.url)
+    return _backend
+
+
+def get_tables(sql: str) -> List[str]:
+    """ get the table names which the sql reads or writes """
+    tables = set()
+    for table_list in table_pattern.findall(sql):
+        tables.update(x.split()[0].strip('`"[]').lower() for x in table_list.split(","))
+    return sorted(tables)
+
+
+def make_key(prefix: str, *parts: Any) -> str:
+    return f"easy_api:{prefix}:" + hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def version_keys(db_alias: str, tables: List[str]) -> List[str]:
+    return [f"easy_api:table:{db_alias}:{x}" for x in tables]
+
+
+def load_version(value: Any) -> int:
+    """ the versions are raw integers written by increment, they never pass the serializer of backend """
+    return 0 if value is None else int(value)
+
+
+async def cached_query(db_alias: str, sql: str, bind_params: Any, ttl: int,
+                       func: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Get the result of query from cache, or call func and cache its result for ttl seconds.
+    The result is invalid once a table which the query reads is changed by invalidate_query.
+    """
+    backend = get_backend()
+    key = make_key("query", db_alias, sql, bind_params)
+    # read the versions before execute, so a write during execute makes the entry stale
+    versions = tuple(await backend.multi_get(version_keys(db_alias, get_tables(sql)), loads_fn=load_version))
+
+    entry: Optional[Tuple[tuple, Any]] = await backend.get(key)
+    if entry is not None and entry[0] == versions:
+        stats["hits"] += 1
+        return entry[1]
+
+    stats["misses"] += 1
+    result = await func()
+    await backend.set(key, (versions, result), ttl=ttl)
+    return result
+
+
+async def invalidate_query(db_alias: str, sql: str):
+    """ invalidate the cached results of the tables which the sql writes """
+    tables = get_tables(sql)
+    if not tables:
+        return
+
+    backend = get_backend()
+    for key in version_keys(db_alias, tables):
+        await backend.increment(key)
+    stats["invalidations"] += 1
+
+
+class SingleFlight:
+    """
+    Coalesce the concurrent calls with the same key onto one in-flight task,
+    every caller gets the same result, and a cancelled caller does not cancel the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # mark the exception as retrieved, the callers may all be cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda x: self._done(key, x))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "coalesced": self.coalesced}
@@ -1,62 +1,184 @@
+import asyncio
 import logging
+import time
 from asyncio import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
-import aioredis
 import msgpack
 import orjson
 import tornado.ioloop
-from celery.result import AsyncResult
+from celery import states
+from celery.backends.rpc import RPCBackend
 
 from easy_api import configs
+from easy_api.celery import app
 
 logger = logging.getLogger("easy_api.redis_waiter")
 
+# celery redis backend publishes the result of task to the channel of its key
+channel_prefix = "celery-task-meta-"
+
 is_redis_backend = True
 waiter = {}
+# the pubsub only subscribes the task ids waited by this process, so it never sees the results of the others
+pubsub = None
+# it is created by install, so it belongs to the running loop
+has_waiter: Optional[asyncio.Event] = None
+# the rpc backend receives the results on the queue of the thread which reads them,
+# so the tasks must reply to the queue of the poll thread rather than the thread which sends them
+reply_to = None
+
+stats = {
+    "subscribes": 0,
+    "messages": 0,
+    "subscribe_seconds": 0.0,
+    "decode_seconds": 0.0,
+    "polls": 0,
+    "poll_seconds": 0.0,
+    "timeouts": 0,
+    "cancellations": 0,
+}
+
+# the backend client is not thread safe, so it is only used by one thread
+poll_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="easy_api_waiter")
+
+
+def decode_result(data: bytes) -> dict:
+    if configs.celery.serializer == 'msgpack':
+        return msgpack.unpackb(data)
+    elif configs.celery.serializer == 'json':
+        return orjson.loads(data)
+    else:
+        logger.warning("unknown serializer: %s", configs.celery.serializer)
+        return data
 
 
 async def start_watch(redis_url):
-    channel_prefix = "celery-task-meta-"
+    # aioredis is only needed by the redis backend
+    import aioredis
 
     redis = aioredis.from_url(redis_url)
     async with redis.pubsub() as p:
-        await p.psubscribe(channel_prefix + "*")
-        while True:
-            result = await p.get_message(ignore_subscribe_messages=True, timeout=10.0)
-            if result is None:
+        await watch(p)
+
+
+async def watch(p):
+    """ resolve the waiters by the results published to the channels of pubsub """
+    global pubsub
+
+    pubsub = p
+    while True:
+        if not waiter:
+            # the connection of pubsub is created by the first subscribe
+            has_waiter.clear()
+            await has_waiter.wait()
+
+        result = await p.get_message(ignore_subscribe_messages=True, timeout=10.0)
+        if result is None:
+            continue
+
+        stats["messages"] += 1
+        try:
+            start = time.perf_counter()
+            result = decode_result(result['data'])
+            stats["decode_seconds"] += time.perf_counter() - start
+
+            if result['status'] not in states.READY_STATES:
                 continue
 
-            try:
-                if configs.celery.serializer == 'msgpack':
-                    result = msgpack.unpackb(result['data'])
-                elif configs.celery.serializer == 'json':
-                    result = orjson.loads(result['data'])
-                else:
-                    logger.warning("unknown serializer: %s", configs.celery.serializer)
-                    result = result['data']
+            await p.unsubscribe(channel_prefix + result['task_id'])
+            f = waiter.pop(result['task_id'], None)
+            if f and not f.done():
+                f.set_result(result['result'])
+        except Exception as e:
+            logger.exception("result: %s, error: %s", result, e)
+
+
+def get_task_metas(task_ids: List[str]) -> Dict[str, dict]:
+    """ get the metas of tasks from the result backend, it runs in the poll executor """
+    backend = app.backend
+    if hasattr(backend, "mget") and hasattr(backend, "get_key_for_task"):
+        # the key value backends get the metas of many tasks in one round trip
+        values = backend.mget([backend.get_key_for_task(x) for x in task_ids])
+        return {task_id: backend.decode_result(value) for task_id, value in zip(task_ids, values) if value}
+    return {task_id: backend.get_task_meta(task_id) for task_id in task_ids}
 
-                f = waiter.pop(result['task_id'], None)
-                if f:
-                    f.set_result(result['result'])
-            except Exception as e:
-                logger.exception("result: %s, error: %s", result, e)
 
+def get_reply_to():
+    """ get the queue which the backend receives the results on, it runs in the poll executor """
+    backend = app.backend
+    return backend.oid if isinstance(backend, RPCBackend) else None
+
+
+async def start_poll():
+    """ poll the results of all waited tasks in batch, used when the backend does not support pubsub """
+    loop = asyncio.get_running_loop()
+    while True:
+        if not waiter:
+            has_waiter.clear()
+            await has_waiter.wait()
+
+        try:
+            start = time.perf_counter()
+            metas = await loop.run_in_executor(poll_executor, get_task_metas, list(waiter))
+            stats["polls"] += 1
+            stats["poll_seconds"] += time.perf_counter() - start
+
+            for task_id, meta in metas.items():
+                if meta.get("status") not in states.READY_STATES:
+                    continue
+                f = waiter.pop(task_id, None)
+                if f and not f.done():
+                    f.set_result(meta["result"])
+        except Exception as e:
+            logger.exception("poll results error: %s", e)
+
+        await asyncio.sleep(configs.celery.result_poll_interval)
+
+
+async def wait_result(task_id: str, future: Future):
+    """ wait task_id result and then set the result to future, it must be called before sending the task """
+    if has_waiter is None:
+        raise RuntimeError("celery waiter is not started")
 
-def wait_result(task_id: str, future: Future):
-    """ wait task_id result and then call callback with result """
     if is_redis_backend:
+        if pubsub is None:
+            raise RuntimeError("celery waiter is not started")
+
         waiter[task_id] = future
+        start = time.perf_counter()
+        await pubsub.subscribe(channel_prefix + task_id)
+        stats["subscribes"] += 1
+        stats["subscribe_seconds"] += time.perf_counter() - start
     else:
-        result = AsyncResult(task_id).get()
-        future.set_result(result)
+        waiter[task_id] = future
+    has_waiter.set()
+
+
+async def forget(task_id: str):
+    """ stop waiting the result of task_id, it is called when the result is timeout or cancelled """
+    if waiter.pop(task_id, None) is None:
+        return
+    if is_redis_backend and pubsub is not None:
+        await pubsub.unsubscribe(channel_prefix + task_id)
+
+
+def get_stats() -> dict:
+    return {"outstanding": len(waiter), **stats}
 
 
 def install():
+    global has_waiter
+    has_waiter = asyncio.Event()
     redis_url = configs.celery.backend
     if redis_url.startswith("redis://"):
         tornado.ioloop.IOLoop.current().add_callback(start_watch, redis_url)
         logger.debug('start celery waiter, redis_uri: %s', redis_url)
     else:
-        global is_redis_backend
+        global is_redis_backend, reply_to
         is_redis_backend = False
-        logger.warning("redis url: %s not start with redis://", redis_url)
+        reply_to = poll_executor.submit(get_reply_to).result()
+        tornado.ioloop.IOLoop.current().add_callback(start_poll)
+        logger.warning("redis url: %s not start with redis://, poll the results every %s seconds",
+                       redis_url, configs.celery.result_poll_interval)
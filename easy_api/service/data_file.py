@@ -1,6 +1,7 @@
 import os.path
 from io import BytesIO
-from typing import Protocol, runtime_checkable
+from itertools import chain
+from typing import Protocol, runtime_checkable, Iterable
 
 from openpyxl import load_workbook, Workbook
 
@@ -42,14 +43,31 @@ def get_datas_from_file(file_name: str, file_data: bytes, fields: str = ""):
         return get_datas_from_xlsx(file_data, fields)
 
 
-def get_xlsx_from_datas(fp: OnlyWrite, datas: list, fields: str = ""):
+def get_header_dict(fields: str = "", first_row: dict = None) -> dict:
+    """
+    Parse the header mapping "field1:title1,field2:title2" to {field1: title1, field2: title2},
+    if fields is empty, use the keys of first row as header.
+    """
+    if not fields:
+        return {x: x for x in first_row or {}}
+
+    header_dict = {}
+    for h in fields.split(","):
+        hs = h.split(':')
+        header_dict[hs[0]] = hs[-1]
+    return header_dict
+
+
+def write_xlsx_rows(fp: OnlyWrite, rows: Iterable[dict], fields: str = ""):
+    """
+    Write rows to fp as xlsx by a write-only workbook,
+    rows can be a generator, so the whole rows never be held in memory.
+    """
+    rows = iter(rows)
+    first_row = None
     if not fields:
-        header_dict = {x: x for x in datas[0]}
-    else:
-        header_dict = {}
-        for h in fields.split(","):
-            hs = h.split(':')
-            header_dict[hs[0]] = hs[-1]
+        first_row = next(rows, None)
+    header_dict = get_header_dict(fields, first_row)
 
     workbook = Workbook(write_only=True)
     worksheet = workbook.create_sheet()
@@ -58,7 +76,7 @@ def get_xlsx_from_datas(fp: OnlyWrite, datas: list, fields: str = ""):
     worksheet.append(tuple(header_dict.values()))
 
     # write remain datas
-    for i, item in enumerate(datas, 2):
+    for item in chain((first_row,), rows) if first_row is not None else rows:
         values = [
             '%s' % item.get(x, "") for x in header_dict
         ]
@@ -66,3 +84,7 @@ def get_xlsx_from_datas(fp: OnlyWrite, datas: list, fields: str = ""):
 
     workbook.close()
     workbook.save(fp)
+
+
+def get_xlsx_from_datas(fp: OnlyWrite, datas: list, fields: str = ""):
+    write_xlsx_rows(fp, datas, fields)
@@ -1,10 +1,23 @@
+import asyncio
+import functools
+import logging
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Union, AsyncIterator, Optional, Tuple
+
 import aiomysql
 import aiosqlite
-from pymysql import FIELD_TYPE, converters
+import tornado.ioloop
+from pymysql import FIELD_TYPE, converters, err
 from typing_extensions import TypedDict
 
 from easy_api import configs
 from easy_api.configs import DatabaseCell
+from easy_api.service import cache
+
+logger = logging.getLogger("easy_api.db")
 
 # avoid converting mysql date to datetime
 mysql_conv = {
@@ -14,6 +27,13 @@ mysql_conv = {
     FIELD_TYPE.TIMESTAMP: str,
 }
 
+# the mysql error codes of lost connection
+mysql_connection_errors = (2003, 2006, 2013)
+
+read_only_pattern = re.compile(r"^\s*(?:select|with|show|explain|describe|desc)\b", re.IGNORECASE)
+write_pattern = re.compile(r"\b(?:insert|update|delete|merge|create|drop|alter|truncate)\b"
+                           r"|\breplace\s+into\b|\binto\s+outfile\b", re.IGNORECASE)
+
 
 class DatabaseResult(TypedDict):
     """
@@ -34,6 +54,246 @@ def find_config(db_alias: str) -> DatabaseCell:
     return found
 
 
+class MysqlPool:
+    """
+    Wrap the aiomysql pool, ping the idle connection before use.
+    """
+
+    def __init__(self, db_config: DatabaseCell):
+        self.loop = asyncio.get_running_loop()
+        self.ping_interval = db_config.pool_ping_interval
+        kwargs = {"charset": db_config.charset} if db_config.charset else {}
+        # the pool will be filled on first acquire
+        self._pool = aiomysql.Pool(minsize=db_config.pool_minsize, maxsize=db_config.pool_maxsize, echo=False,
+                                   pool_recycle=db_config.pool_recycle, loop=self.loop,
+                                   host=db_config.host, port=db_config.port, db=db_config.db,
+                                   user=db_config.user, password=db_config.password, conv=mysql_conv,
+                                   cursorclass=aiomysql.cursors.DictCursor, **kwargs)
+
+    async def open(self):
+        # acquire once to fill the pool up to minsize
+        async with self._pool.acquire():
+            pass
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._pool.acquire() as conn:
+            if 0 < self.ping_interval < self.loop.time() - conn.last_usage:
+                await conn.ping(reconnect=True)
+            # the connection in transaction will be closed by the pool when it is released
+            yield conn
+
+    async def close(self):
+        self._pool.close()
+        await self._pool.wait_closed()
+
+
+class SqlitePool:
+    """
+    A tiny connection pool for aiosqlite, it has the same acquire/close api as MysqlPool.
+    """
+
+    def __init__(self, db_config: DatabaseCell):
+        # aiosqlite connection runs in its own thread, so it can be used by any loop
+        self.loop = None
+        self.db = db_config.db
+        self.minsize = db_config.pool_minsize
+        self.recycle = db_config.pool_recycle
+        self.ping_interval = db_config.pool_ping_interval
+        self._free = deque()
+        self._semaphore = asyncio.Semaphore(db_config.pool_maxsize)
+        self._closed = False
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db)
+        conn.row_factory = aiosqlite.Row
+        conn.last_usage = time.monotonic()
+        return conn
+
+    async def _get(self) -> aiosqlite.Connection:
+        while self._free:
+            conn = self._free.popleft()
+            idle = time.monotonic() - conn.last_usage
+            if -1 < self.recycle < idle:
+                await conn.close()
+                continue
+            if 0 < self.ping_interval < idle:
+                try:
+                    await conn.execute("select 1")
+                except Exception as e:
+                    logger.warning("drop broken sqlite connection of %s: %s", self.db, e)
+                    await conn.close()
+                    continue
+            return conn
+        return await self._connect()
+
+    async def open(self):
+        while len(self._free) < self.minsize:
+            self._free.append(await self._connect())
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self._closed:
+            raise RuntimeError("Cannot acquire connection after close()")
+
+        async with self._semaphore:
+            conn = await self._get()
+            try:
+                yield conn
+            finally:
+                try:
+                    if conn.in_transaction:
+                        await conn.rollback()
+                    conn.last_usage = time.monotonic()
+                    if self._closed:
+                        await conn.close()
+                    else:
+                        self._free.append(conn)
+                except Exception as e:
+                    logger.warning("drop broken sqlite connection of %s: %s", self.db, e)
+                    await conn.close()
+
+    async def close(self):
+        self._closed = True
+        while self._free:
+            await self._free.popleft().close()
+
+
+Pool = Union[MysqlPool, SqlitePool]
+pools: Dict[str, Pool] = {}
+
+
+def get_pool(db_config: DatabaseCell) -> Pool:
+    """
+    Get the connection pool of the database, create it on first use.
+
+    :param db_config: The configuration of the database.
+    :return: The connection pool of the database.
+    """
+    pool = pools.get(db_config.name)
+    if pool is not None and pool.loop in (None, asyncio.get_running_loop()):
+        return pool
+
+    if db_config.type == 'mysql':
+        pool = MysqlPool(db_config)
+    elif db_config.type == 'sqlite':
+        pool = SqlitePool(db_config)
+    else:
+        raise ValueError(f"Database type '{db_config.type}' not supported.")
+
+    pools[db_config.name] = pool
+    return pool
+
+
+class ReplicaState:
+    """
+    The runtime state of a replica.
+    """
+
+    def __init__(self):
+        self.healthy = True
+        self.outstanding = 0
+        self.lag: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {"healthy": self.healthy, "outstanding": self.outstanding, "lag": self.lag}
+
+
+replica_states: Dict[str, ReplicaState] = {}
+round_robin_index: Dict[str, int] = {}
+
+
+def get_replica_state(replica: DatabaseCell) -> ReplicaState:
+    if replica.name not in replica_states:
+        replica_states[replica.name] = ReplicaState()
+    return replica_states[replica.name]
+
+
+def choose_instance(db_config: DatabaseCell, read_only: bool) -> DatabaseCell:
+    """
+    Choose the instance to execute the statement, the read only statement is sent to a healthy replica,
+    the others, or there is no healthy replica, are sent to the primary.
+
+    :param db_config: The configuration of the primary database.
+    :param read_only: Whether the statement only reads data.
+    :return: The configuration of the chosen instance.
+    """
+    if not read_only or not db_config.replicas:
+        return db_config
+
+    candidates = [x for x in db_config.replicas if get_replica_state(x).healthy]
+    if not candidates:
+        return db_config
+
+    if db_config.replica_strategy == "least_outstanding":
+        return min(candidates, key=lambda x: get_replica_state(x).outstanding)
+
+    index = round_robin_index.get(db_config.name, 0)
+    round_robin_index[db_config.name] = index + 1
+    return candidates[index % len(candidates)]
+
+
+def is_connection_error(e: Exception) -> bool:
+    if isinstance(e, (OSError, asyncio.TimeoutError)):
+        return True
+    return isinstance(e, err.OperationalError) and bool(e.args) and e.args[0] in mysql_connection_errors
+
+
+async def check_replica(replica: DatabaseCell) -> Optional[float]:
+    """
+    Check the replica is available and return its lag in seconds, None means unknown.
+    """
+    async with get_pool(replica).acquire() as conn:
+        if replica.type != 'mysql':
+            await conn.execute("select 1")
+            return 0
+
+        async with conn.cursor() as cur:
+            try:
+                await cur.execute("SHOW REPLICA STATUS")
+            except err.ProgrammingError:
+                # mysql before 8.0.22
+                await cur.execute("SHOW SLAVE STATUS")
+            row = await cur.fetchone()
+
+    if not row:
+        return None
+    lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+    if lag is None:
+        raise RuntimeError("replication is not running")
+    return lag
+
+
+async def check_replicas(db_config: DatabaseCell):
+    """
+    Check the health and lag of replicas of the database, exclude the unhealthy ones from reading.
+    """
+    for replica in db_config.replicas:
+        state = get_replica_state(replica)
+        try:
+            state.lag = await check_replica(replica)
+            healthy = not (0 < db_config.replica_max_lag and state.lag is not None
+                           and state.lag > db_config.replica_max_lag)
+        except Exception as e:
+            logger.debug("check replica %s error: %s", replica.name, e)
+            healthy = False
+
+        if healthy != state.healthy:
+            logger.warning("replica %s is %s, lag: %s", replica.name, "healthy" if healthy else "unhealthy",
+                           state.lag)
+        state.healthy = healthy
+
+
+async def watch_replicas(db_config: DatabaseCell):
+    while True:
+        await check_replicas(db_config)
+        await asyncio.sleep(db_config.replica_check_interval)
+
+
+def replica_stats() -> Dict[str, dict]:
+    return {name: state.to_dict() for name, state in replica_states.items()}
+
+
 async def execute_mysql(db_config: DatabaseCell, sql: str, bind_params: list,
                         autocommit: bool = True) -> DatabaseResult:
     """
@@ -45,10 +305,7 @@ async def execute_mysql(db_config: DatabaseCell, sql: str, bind_params: list,
     :param autocommit: Whether to automatically commit the transaction.
     :return: The result of the SQL statement.
     """
-    pool = await aiomysql.create_pool(host=db_config.host, port=db_config.port, db=db_config.db,
-                                      user=db_config.user, password=db_config.password, conv=mysql_conv,
-                                      cursorclass=aiomysql.cursors.DictCursor)
-    async with pool.acquire() as conn:
+    async with get_pool(db_config).acquire() as conn:
         async with conn.cursor() as cur:
             # FIXME this is aiomysql bug, it doesn't support named parameters
             query = sql.replace('%', '%%').replace('?', '%s')
@@ -57,7 +314,6 @@ async def execute_mysql(db_config: DatabaseCell, sql: str, bind_params: list,
                 await conn.commit()
             result = await cur.fetchall()
 
-    pool.close()
     return {'result': result, 'changes': changes}
 
 
@@ -72,18 +328,77 @@ async def execute_sqlite(db_config: DatabaseCell, sql: str, bind_params: list,
     :param autocommit: Whether to automatically commit the transaction.
     :return: The result of the SQL statement.
     """
-    async with aiosqlite.connect(db_config.db) as db:
-        db.row_factory = aiosqlite.Row
-        async with await db.execute(sql, bind_params) as cur:
+    async with get_pool(db_config).acquire() as db:
+        total_changes = db.total_changes
+        async with await db.execute(sql, bind_params or []) as cur:
             if autocommit:
                 await db.commit()
             result = await cur.fetchall()
-            changes = db.total_changes
+            changes = db.total_changes - total_changes
 
     return {'result': [dict(x) for x in result], 'changes': changes}
 
 
-async def execute(db_alias: str, sql: str, bind_params: list = None, autocommit: bool = True) -> DatabaseResult:
+def is_read_only(sql: str) -> bool:
+    """
+    Check the SQL statement only reads data, a statement which may write is not read only.
+    """
+    return bool(read_only_pattern.match(sql)) and not write_pattern.search(sql)
+
+
+async def execute_by_config(db_config: DatabaseCell, sql: str, bind_params: list = None,
+                            autocommit: bool = True) -> DatabaseResult:
+    if db_config.type == 'mysql':
+        return await execute_mysql(db_config, sql, bind_params, autocommit)
+    elif db_config.type == 'sqlite':
+        return await execute_sqlite(db_config, sql, bind_params, autocommit)
+    else:
+        raise ValueError(f"Database type '{db_config.type}' not supported.")
+
+
+async def execute_read(db_config: DatabaseCell, sql: str, bind_params: list = None,
+                       autocommit: bool = True) -> DatabaseResult:
+    """
+    Execute a read only statement in a replica if there is one,
+    the replica is excluded and the statement is sent to the primary when the replica lost connection.
+    The statement in a transaction (not autocommit) is always sent to the primary.
+    """
+    instance = choose_instance(db_config, autocommit)
+    if instance is db_config:
+        return await execute_by_config(db_config, sql, bind_params, autocommit)
+
+    state = get_replica_state(instance)
+    state.outstanding += 1
+    try:
+        return await execute_by_config(instance, sql, bind_params, autocommit)
+    except Exception as e:
+        if not is_connection_error(e):
+            raise
+        logger.warning("replica %s is unhealthy: %s, fall back to %s", instance.name, e, db_config.name)
+        state.healthy = False
+        return await execute_by_config(db_config, sql, bind_params, autocommit)
+    finally:
+        state.outstanding -= 1
+
+
+query_flight = cache.SingleFlight()
+# the number of writes to each table in this process, the flight key contains the counts of the tables
+# which the query reads, so a read issued after a write never joins a flight started before it
+write_counts: Dict[Tuple[str, str], int] = {}
+
+
+def get_flight_key(db_alias: str, sql: str, bind_params: list) -> tuple:
+    counts = tuple(write_counts.get((db_alias, x), 0) for x in cache.get_tables(sql))
+    return db_alias, sql, repr(bind_params), counts
+
+
+def count_write(db_alias: str, sql: str):
+    for table in cache.get_tables(sql):
+        write_counts[(db_alias, table)] = write_counts.get((db_alias, table), 0) + 1
+
+
+async def execute(db_alias: str, sql: str, bind_params: list = None, autocommit: bool = True,
+                  cache_ttl: int = 0, coalesce: bool = True) -> DatabaseResult:
     """
     Execute a SQL statement and return the result.
     If it can't find the db alias in config, raise an exception.
@@ -92,15 +407,146 @@ async def execute(db_alias: str, sql: str, bind_params: list = None, autocommit:
     :param sql: The SQL statement to execute.
     :param bind_params: A dictionary of parameters to bind to the SQL statement.
     :param autocommit: Whether to automatically commit the transaction. default: True
+    :param cache_ttl: Cache the result of read only statement for seconds, 0 means no cache. default: 0
+    :param coalesce: Whether to share one in-flight query between the concurrent identical read only calls,
+                     all callers get the same result. default: True
     :return: The result of the SQL statement.
     """
     db_config = find_config(db_alias)
     if db_config is None:
         raise ValueError(f"Database alias '{db_alias}' not found.")
 
-    if db_config.type == 'mysql':
-        return await execute_mysql(db_config, sql, bind_params, autocommit)
-    elif db_config.type == 'sqlite':
-        return await execute_sqlite(db_config, sql, bind_params, autocommit)
+    if is_read_only(sql):
+        func = functools.partial(execute_read, db_config, sql, bind_params, autocommit)
+        if cache_ttl > 0:
+            func = functools.partial(cache.cached_query, db_alias, sql, bind_params, cache_ttl, func)
+        if coalesce:
+            return await query_flight.do(get_flight_key(db_alias, sql, bind_params), func)
+        return await func()
+
+    try:
+        result = await execute_by_config(db_config, sql, bind_params, autocommit)
+    finally:
+        # the write may be committed even if it raises
+        count_write(db_alias, sql)
+    # the cached results of the tables which are written are stale
+    await cache.invalidate_query(db_alias, sql)
+    return result
+
+
+async def stream_mysql(db_config: DatabaseCell, sql: str, bind_params: list, batch_size: int = 1000,
+                       autocommit: bool = True) -> AsyncIterator[list]:
+    """
+    Execute a SQL statement in mysql and yield the rows in batches by a server side cursor.
+
+    :param db_config: The configuration of the database to use.
+    :param sql: The SQL statement to execute.
+    :param bind_params: A dictionary of parameters to bind to the SQL statement.
+    :param batch_size: The max number of rows in each batch.
+    :param autocommit: Whether to automatically commit the transaction.
+    :return: The async iterator of the row batches.
+    """
+    async with get_pool(db_config).acquire() as conn:
+        async with conn.cursor(aiomysql.cursors.SSDictCursor) as cur:
+            query = sql.replace('%', '%%').replace('?', '%s')
+            await cur.execute(query, bind_params)
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        if autocommit:
+            await conn.commit()
+
+
+async def stream_sqlite(db_config: DatabaseCell, sql: str, bind_params: list, batch_size: int = 1000,
+                        autocommit: bool = True) -> AsyncIterator[list]:
+    """
+    Execute a SQL statement in sqlite and yield the rows in batches.
+
+    :param db_config: The configuration of the database to use.
+    :param sql: The SQL statement to execute.
+    :param bind_params: A dictionary of parameters to bind to the SQL statement.
+    :param batch_size: The max number of rows in each batch.
+    :param autocommit: Whether to automatically commit the transaction.
+    :return: The async iterator of the row batches.
+    """
+    async with get_pool(db_config).acquire() as db:
+        async with await db.execute(sql, bind_params or []) as cur:
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(x) for x in rows]
+        if autocommit:
+            await db.commit()
+
+
+async def execute_stream(db_alias: str, sql: str, bind_params: list = None, batch_size: int = 1000,
+                         autocommit: bool = True) -> AsyncIterator[list]:
+    """
+    Execute a SQL statement and yield the rows in batches, only one batch is held in memory at a time.
+    If it can't find the db alias in config, raise an exception.
+
+    :param db_alias: The alias of the database to use.
+    :param sql: The SQL statement to execute.
+    :param bind_params: A dictionary of parameters to bind to the SQL statement.
+    :param batch_size: The max number of rows in each batch. default: 1000
+    :param autocommit: Whether to automatically commit the transaction. default: True
+    :return: The async iterator of the row batches.
+    """
+    db_config = find_config(db_alias)
+    if db_config is None:
+        raise ValueError(f"Database alias '{db_alias}' not found.")
+
+    instance = choose_instance(db_config, autocommit and is_read_only(sql))
+    if instance.type == 'mysql':
+        stream = stream_mysql(instance, sql, bind_params, batch_size, autocommit)
+    elif instance.type == 'sqlite':
+        stream = stream_sqlite(instance, sql, bind_params, batch_size, autocommit)
     else:
-        raise ValueError(f"Database type '{db_config.type}' not supported.")
+        raise ValueError(f"Database type '{instance.type}' not supported.")
+
+    state = get_replica_state(instance) if instance is not db_config else None
+    if state:
+        state.outstanding += 1
+    try:
+        async for rows in stream:
+            yield rows
+    finally:
+        if state:
+            state.outstanding -= 1
+
+
+async def open_pools():
+    """
+    Create the connection pools of all databases, it is called at startup.
+    """
+    for db_config in configs.database.instances:
+        for instance in (db_config, *db_config.replicas):
+            try:
+                await get_pool(instance).open()
+                logger.debug("open connection pool of %s", instance.name)
+            except Exception as e:
+                # the pool will try to connect again on first use
+                logger.warning("open connection pool of %s error: %s", instance.name, e)
+
+
+async def close_pools():
+    """
+    Close the connection pools of all databases, it is called at shutdown.
+    """
+    while pools:
+        name, pool = pools.popitem()
+        try:
+            await pool.close()
+        except Exception as e:
+            logger.warning("close connection pool of %s error: %s", name, e)
+
+
+def install():
+    io_loop = tornado.ioloop.IOLoop.current()
+    io_loop.add_callback(open_pools)
+    for db_config in configs.database.instances:
+        if db_config.replicas:
+            io_loop.add_callback(watch_replicas, db_config)
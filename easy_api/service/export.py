@@ -1,8 +1,22 @@
+import asyncio
+import csv
+import io
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, Optional
 
+import orjson
 from tornado.web import RequestHandler
 
-from easy_api.service.data_file import get_xlsx_from_datas
+from easy_api.service.data_file import get_xlsx_from_datas, write_xlsx_rows, get_header_dict
+
+# the max size of bytes buffered by the writer before sending them to the client
+WRITE_BUFFER_SIZE = 64 * 1024
+# the max number of xlsx files written at the same time, each one holds a thread until it was sent
+MAX_XLSX_WORKERS = 4
+
+# the xlsx writers wait for the client, so they have their own pool instead of the default executor of the loop
+xlsx_executor = ThreadPoolExecutor(max_workers=MAX_XLSX_WORKERS, thread_name_prefix="easy_api_export")
 
 
 class HandlerWrite:
@@ -19,12 +33,201 @@ class HandlerWrite:
         self._handler.flush()
 
 
-async def export_xlsx_file(handler: RequestHandler, data: list, file_name: str = "export", header: str = None) -> None:
-    # file name
+class ThreadHandlerWrite:
+    """
+    The writer used in an executor thread, the chunks are sent to the client by the event loop,
+    it waits until the chunks were flushed, so the memory is bounded by the buffer size.
+    """
+    _handler: RequestHandler = None
+
+    def __init__(self, handler: RequestHandler, loop: asyncio.AbstractEventLoop, buffer_size: int = WRITE_BUFFER_SIZE):
+        self._handler = handler
+        self._loop = loop
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+
+    async def _send(self, chunk: bytes):
+        self._handler.write(chunk)
+        await self._handler.flush()
+
+    def write(self, chunk) -> int:
+        self._buffer.append(bytes(chunk))
+        self._buffered += len(chunk)
+        if self._buffered >= self._buffer_size:
+            self.flush()
+        return len(chunk)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        chunk = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        asyncio.run_coroutine_threadsafe(self._send(chunk), self._loop).result()
+
+
+def iter_rows_in_thread(batches: AsyncIterator[list], loop: asyncio.AbstractEventLoop) -> Iterator[dict]:
+    """
+    Iterate the rows of the async batches in an executor thread,
+    the next batch is only fetched when the rows of current batch were consumed.
+    """
+    iterator = batches.__aiter__()
+
+    async def next_batch():
+        return await iterator.__anext__()
+
+    while True:
+        try:
+            rows = asyncio.run_coroutine_threadsafe(next_batch(), loop).result()
+        except StopAsyncIteration:
+            return
+        yield from rows
+
+
+def set_attachment_headers(handler: RequestHandler, content_type: str, file_name: str):
     file_name = urllib.parse.quote(file_name)
-    handler.set_header('Content-Type', "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    handler.set_header("Content-Disposition", f"attachment; filename={file_name}.xlsx")
+    handler.set_header('Content-Type', content_type)
+    handler.set_header("Content-Disposition", f"attachment; filename={file_name}")
 
-    handler_write = HandlerWrite(handler)
-    get_xlsx_from_datas(handler_write, data, header)
+
+async def export_xlsx_file(handler: RequestHandler, data: list, file_name: str = "export", header: str = None) -> None:
+    set_attachment_headers(handler, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           f"{file_name}.xlsx")
+
+    loop = asyncio.get_running_loop()
+    handler_write = ThreadHandlerWrite(handler, loop)
+    await loop.run_in_executor(xlsx_executor, get_xlsx_from_datas, handler_write, data, header)
     await handler.finish()
+
+
+async def export_xlsx_stream(handler: RequestHandler, batches: AsyncIterator[list], file_name: str = "export",
+                             header: str = None) -> None:
+    """
+    Export the rows from batches to xlsx file, the workbook is written in an executor thread,
+    the rows are pulled batch by batch and the file is sent to the client by chunks.
+    """
+    set_attachment_headers(handler, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           f"{file_name}.xlsx")
+
+    loop = asyncio.get_running_loop()
+    handler_write = ThreadHandlerWrite(handler, loop)
+    rows = iter_rows_in_thread(batches, loop)
+    try:
+        await loop.run_in_executor(xlsx_executor, write_xlsx_rows, handler_write, rows, header)
+    finally:
+        # release the cursor if the writer stops early
+        await batches.aclose()
+    await handler.finish()
+
+
+async def export_csv_stream(handler: RequestHandler, batches: AsyncIterator[list], file_name: str = "export",
+                            header: str = None) -> None:
+    """
+    Export the rows from batches to csv file, each batch is flushed to the client after it was written.
+    """
+    set_attachment_headers(handler, "text/csv; charset=UTF-8", f"{file_name}.csv")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_dict = get_header_dict(header) if header else None
+    if header_dict is not None:
+        writer.writerow(header_dict.values())
+
+    async for rows in batches:
+        if not rows:
+            continue
+        if header_dict is None:
+            header_dict = get_header_dict(header, rows[0])
+            writer.writerow(header_dict.values())
+        writer.writerows([item.get(x, "") for x in header_dict] for item in rows)
+        handler.write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+        await handler.flush()
+
+    handler.write(buffer.getvalue())
+    await handler.finish()
+
+
+async def export_ndjson_stream(handler: RequestHandler, batches: AsyncIterator[list], file_name: str = "export",
+                               header: str = None) -> None:
+    """
+    Export the rows from batches to newline delimited json file, one row per line,
+    the keys of row are renamed by the header if it is provided.
+    """
+    set_attachment_headers(handler, "application/x-ndjson", f"{file_name}.ndjson")
+
+    header_dict = get_header_dict(header) if header else None
+    async for rows in batches:
+        if not rows:
+            continue
+        if header_dict is not None:
+            rows = [{v: item.get(k) for k, v in header_dict.items()} for item in rows]
+        handler.write(b"".join(orjson.dumps(item) + b"\n" for item in rows))
+        await handler.flush()
+
+    await handler.finish()
+
+
+EXPORT_FORMATS = {
+    "xlsx": export_xlsx_stream,
+    "csv": export_csv_stream,
+    "ndjson": export_ndjson_stream,
+}
+
+ACCEPT_FORMATS = {
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+}
+
+
+def parse_accept(accept: str) -> Dict[str, float]:
+    """ parse the Accept header to the quality of each media range, the invalid quality is 0 """
+    qualities = {}
+    for media_range in accept.split(","):
+        media_type, *params = media_range.split(";")
+        media_type = media_type.strip().lower()
+        if not media_type:
+            continue
+
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type] = max(quality, qualities.get(media_type, 0.0))
+    return qualities
+
+
+def get_export_format(accept: Optional[str]) -> Optional[str]:
+    """
+    Get the export format from the Accept header, return None if it does not accept any export format.
+    The export format is only used if the client prefers it to json, the most specific range of json counts,
+    so "application/json, text/csv;q=0.5" gets json.
+    """
+    if not accept:
+        return None
+
+    qualities = parse_accept(accept)
+    json_quality = next((qualities[x] for x in ("application/json", "application/*", "*/*") if x in qualities), 0.0)
+
+    export_format, export_quality = None, 0.0
+    for media_type, quality in qualities.items():
+        if media_type in ACCEPT_FORMATS and quality > export_quality:
+            export_format, export_quality = ACCEPT_FORMATS[media_type], quality
+    return export_format if export_quality > json_quality else None
+
+
+async def export_stream(handler: RequestHandler, export_format: str, batches: AsyncIterator[list],
+                        file_name: str = "export", header: str = None) -> None:
+    """
+    Export the rows from batches to the file of export format, xlsx, csv or ndjson.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Export format '{export_format}' not supported.")
+    await EXPORT_FORMATS[export_format](handler, batches, file_name, header)
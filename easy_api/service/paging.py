@@ -0,0 +1,87 @@
+import base64
+import re
+from typing import List, Tuple
+
+import orjson
+
+from easy_api.service import db
+
+COUNT_MODES = ("exact", "estimate", "none")
+
+column_pattern = re.compile(r"^\w+$")
+
+
+def parse_keyset(keyset: str) -> Tuple[List[str], bool]:
+    """
+    Parse the keyset like "created_at desc, id desc" to the columns and whether it is descending,
+    the columns must be in the same direction, so they can be compared as a row value.
+    """
+    columns = []
+    directions = set()
+    for item in keyset.split(","):
+        parts = item.split()
+        if not parts or len(parts) > 2 or not column_pattern.match(parts[0]):
+            raise ValueError(f"invalid keyset column '{item.strip()}'")
+        direction = parts[1].lower() if len(parts) == 2 else "asc"
+        if direction not in ("asc", "desc"):
+            raise ValueError(f"invalid keyset direction '{parts[1]}'")
+        columns.append(parts[0])
+        directions.add(direction)
+
+    if len(directions) > 1:
+        raise ValueError("keyset columns must be in the same direction")
+    return columns, directions == {"desc"}
+
+
+def get_keyset_sql_jinja(sql_jinja: str, keyset: str) -> str:
+    """
+    Wrap the sql to seek the page after the cursor, the cursor is the values of keyset columns of the last row,
+    it fetches one more row than page size to know whether there is a next page.
+    """
+    columns, descending = parse_keyset(keyset)
+    direction = " desc" if descending else ""
+    operator = "<" if descending else ">"
+    cursor_values = ", ".join(f"{{{{ KEYSET_CURSOR[{i}] }}}}" for i in range(len(columns)))
+
+    return "{% set _page_size = page_size|default(10) %}\n" \
+           f"select * from ({sql_jinja}) as _keyset\n" \
+           "{% if KEYSET_CURSOR %}" \
+           f"where ({', '.join(columns)}) {operator} ({cursor_values})" \
+           "{% endif %}\n" \
+           f"order by {', '.join(x + direction for x in columns)} limit {{{{ _page_size + 1 }}}}"
+
+
+def encode_cursor(values: list) -> str:
+    """ encode the values of keyset columns to an opaque cursor """
+    return base64.urlsafe_b64encode(orjson.dumps(values, default=str)).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """ decode the cursor to the values of keyset columns, raise ValueError if the cursor is invalid """
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("invalid cursor")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("invalid cursor")
+    return values
+
+
+async def estimate_count(db_alias: str, sql: str, bind_params: list = None, cache_ttl: int = 0) -> int:
+    """
+    Estimate the number of rows of the sql by the query plan of mysql, it is much faster than count on big tables,
+    the other databases count the rows exactly.
+    """
+    db_config = db.find_config(db_alias)
+    if db_config is not None and db_config.type == "mysql":
+        result = await db.execute(db_alias, f"explain {sql}", bind_params, cache_ttl=cache_ttl)
+        # the rows of a join are the product of rows of each table
+        count = 1.0
+        for item in result["result"]:
+            count *= (item.get("rows") or 0) * float(item.get("filtered") or 100) / 100
+        return int(count) if result["result"] else 0
+
+    result = await db.execute(db_alias, f"select count(*) as `count` from ({sql}) as _count", bind_params,
+                              cache_ttl=cache_ttl)
+    return list(result["result"][0].values())[0]
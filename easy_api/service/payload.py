@@ -0,0 +1,148 @@
+import logging
+import os
+import pickle
+import time
+from typing import Any, Optional
+
+from kombu import uuid
+
+from easy_api import configs
+
+logger = logging.getLogger("easy_api.payload")
+
+# the key of the handle which refers to the payload in the side store
+REFERENCE_KEY = "__easy_api_payload__"
+# sweep the expired payload files at most every seconds
+SWEEP_INTERVAL = 60
+
+stats = {
+    "stored": 0,
+    "stored_bytes": 0,
+    "loaded": 0,
+}
+
+
+class FileStore:
+    """ Keep the payloads in a directory shared by the server and workers, like a nfs mount """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._last_sweep = 0.0
+        os.makedirs(path, exist_ok=True)
+
+    def put(self, key: str, data: bytes, ttl: int):
+        self.sweep(ttl)
+        tmp_path = os.path.join(self.path, f".{key}.tmp")
+        with open(tmp_path, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, os.path.join(self.path, key))
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.path, key), "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str):
+        try:
+            os.remove(os.path.join(self.path, key))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, ttl: int):
+        """ remove the payloads older than ttl, which were left by the crashed processes """
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+
+        for entry in os.scandir(self.path):
+            try:
+                if now - entry.stat().st_mtime > ttl:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+
+
+class RedisStore:
+    """ Keep the payloads in redis with expiration """
+
+    def __init__(self, url: str):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def put(self, key: str, data: bytes, ttl: int):
+        self._redis.set(f"easy_api:payload:{key}", data, ex=ttl)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._redis.get(f"easy_api:payload:{key}")
+
+    def delete(self, key: str):
+        self._redis.delete(f"easy_api:payload:{key}")
+
+
+_stores = {}
+
+
+def get_store():
+    """ get the side store from config, file:///path or redis://, None means the payloads are always inline """
+    url = configs.celery.payload_store
+    if not url:
+        return None
+    if url not in _stores:
+        _stores[url] = FileStore(url[len("file://"):]) if url.startswith("file://") else RedisStore(url)
+    return _stores[url]
+
+
+def get_ttl() -> int:
+    # the payload is useless after the task is timeout
+    return int(configs.celery.task_timeout) or 24 * 60 * 60
+
+
+def dumps(value: Any) -> Optional[bytes]:
+    """ serialize the value if it should be passed by reference, otherwise return None """
+    if get_store() is None or not configs.celery.payload_threshold:
+        return None
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    return data if len(data) > configs.celery.payload_threshold else None
+
+
+def put(data: bytes) -> dict:
+    """ save the serialized value to the side store and return the handle, it blocks, so run it in executor """
+    key = uuid()
+    get_store().put(key, data, get_ttl())
+    stats["stored"] += 1
+    stats["stored_bytes"] += len(data)
+    return {REFERENCE_KEY: key}
+
+
+def offload(value: Any) -> Any:
+    """ return the handle of value if it is large, otherwise the value itself """
+    data = dumps(value)
+    return value if data is None else put(data)
+
+
+def is_reference(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and REFERENCE_KEY in value
+
+
+def load(reference: dict, delete: bool = False) -> Any:
+    """ fetch the value of handle from the side store """
+    data = get_store().get(reference[REFERENCE_KEY])
+    if data is None:
+        raise ValueError(f"payload {reference[REFERENCE_KEY]} not found, it may be expired")
+    if delete:
+        get_store().delete(reference[REFERENCE_KEY])
+    stats["loaded"] += 1
+    return pickle.loads(data)
+
+
+def discard(reference: Any):
+    """ remove the payload of handle, it does nothing if the value is not a handle """
+    if not is_reference(reference):
+        return
+    try:
+        get_store().delete(reference[REFERENCE_KEY])
+    except Exception as e:
+        logger.warning("discard payload %s error: %s", reference[REFERENCE_KEY], e)
@@ -1,33 +1,64 @@
 import asyncio
+import functools
 import logging
-from ast import literal_eval
+import re
+import time
 from dataclasses import asdict
-from typing import List, Dict
+from typing import Any, AsyncIterator, Callable, List, Dict, Optional, Tuple
 
-from jinja2 import Template
+import orjson
+from jinja2 import Undefined
+from jinja2.nativetypes import NativeEnvironment
 
 from easy_api.handler.schema.pipeline import TaskSchema
-from easy_api.schema import is_successful_result
-from easy_api.tasks import get_task_by_name
+from easy_api.schema import Result, is_successful_result
+from easy_api.tasks import get_task_by_name, get_stream_by_name
 
 logger = logging.getLogger("easy_api.pipeline")
 
 
+# the max number of compiled expressions to keep in memory
+EXPRESSION_CACHE_SIZE = 1024
+
+# the text is only one expression like {{ result.data }}
+expression_pattern = re.compile(r"^\s*\{\{((?:(?!\}\}|\{\{).)*)\}\}\s*$", re.DOTALL)
+
+native_env = NativeEnvironment()
+
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_inline_template(text: str) -> Callable[[dict], Any]:
+    """
+    Compile the template in a string once, the compiled function returns the python value directly.
+    The text of only one expression is compiled to a native expression, the value never be converted to string,
+    the others are rendered to string and then parsed as a literal if it can be.
+    """
+    match = expression_pattern.match(text)
+    if match:
+        expression = native_env.compile_expression(match.group(1), undefined_to_none=False)
+
+        def execute_expression(context: dict) -> Any:
+            value = expression(context)
+            return "" if isinstance(value, Undefined) else value
+
+        return execute_expression
+
+    template = native_env.from_string(text)
+
+    def execute_template(context: dict) -> Any:
+        value = template.render(context)
+        return "" if value is None else value
+
+    return execute_template
+
+
 def execute_inline_template(text: str, context: dict) -> any:
     """
     Execute a template in a string.
     :param text: The template string.
     :param context: The context.
     """
-    value = Template(text).render(context)
-    if not value:
-        return ""
-
-    try:
-        return literal_eval(value)
-    except ValueError:
-        # this is a hack to handle the case where the value type is a string
-        return literal_eval(f"""'{value}'""")
+    return compile_inline_template(text)(context)
 
 
 def execute_condition_template(condition: str, context: dict) -> bool:
@@ -36,53 +67,320 @@ def execute_condition_template(condition: str, context: dict) -> bool:
     return True if execute_inline_template(condition, context) else False
 
 
-async def wrap_task(package_name, name, inputs, output, context):
-    # FIXME hard to debug
+async def wrap_task(package_name, name, inputs, output, context, span: dict = None):
     if not output:
         # It not wants to save the result
         return {}
 
     job = get_task_by_name(package_name, name)
+    start = time.perf_counter()
     result = await job(**inputs, **context)
-    if is_successful_result(result):
+    if span is not None:
+        span["execute_seconds"] = time.perf_counter() - start
+    return map_output(result, output, span)
+
+
+def map_output(result, output: dict, span: dict = None) -> dict:
+    start = time.perf_counter()
+    successful = is_successful_result(result)
+    if successful:
         result = asdict(result)
-        return {k: execute_inline_template(v, {"result": result}) for k, v in output.items()}
+        outputs = {k: execute_inline_template(v, {"result": result}) for k, v in output.items()}
     else:
-        for key in output:
-            return {f"{key}_error": result}
+        outputs = {f"{key}_error": result for key in list(output)[:1]}
 
+    if span is not None:
+        span["render_seconds"] = time.perf_counter() - start
+        span["result_size"] = get_result_size(result)
+        span["status"] = "success" if successful else "failure"
+    return outputs
 
-async def run(task_configs: List[TaskSchema]):
+
+def get_result_size(result) -> int:
+    """ get the bytes of result in json, it is only used by trace """
+    try:
+        return len(orjson.dumps(asdict(result) if not isinstance(result, dict) else result, default=str))
+    except Exception:
+        return 0
+
+
+async def call_in_chunks(task: TaskSchema, context: dict, chunks: AsyncIterator, argument: str,
+                         concurrency: int) -> Tuple[Any, list]:
     """
-    Create a group file from a jinja template.
-    :param task_configs: The task inputs.
+    Call the task once per chunk with the chunk as the argument, the calls are sent to the workers
+    at the same time up to the concurrency. The next chunk is not taken until a slot is free,
+    so only a few chunks are kept in memory however many the iterator yields.
+    The chunks are not taken anymore once a chunk is failed or raises, the exception is raised after
+    the running chunks are cancelled.
+    :return: The first failed result or None, and the results of the chunks in order.
     """
-    # group by layer and then order execute task by layer
-    task_dicts: Dict[int, List[TaskSchema]] = {}
-    for task in task_configs:
-        task_dicts.setdefault(task.layer, []).append(task)
-
-    # context for next layer tasks
-    results = {}
-
-    for layer in range(5):
-        if layer not in task_dicts:
-            break
-
-        # build the tasks for this layer
-        tasks = [
-            wrap_task(x.package_name, x.name, x.kwargs, x.output, results)
-            for x in task_dicts[layer]
-            if execute_condition_template(x.condition, results)
-        ]
-
-        if len(tasks) == 1:
-            result = await tasks[0]
-            results = [result]
+    job = get_task_by_name(task.package_name, task.name)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    futures: List[asyncio.Future] = []
+    failed = None
+
+    async def consume(chunk):
+        nonlocal failed
+        try:
+            result = await job(**task.kwargs, **context, **{argument: chunk})
+        except Exception as e:
+            if failed is None:
+                failed = e
+            raise
         else:
-            results = await asyncio.gather(*tasks)
+            if failed is None and not is_successful_result(result):
+                failed = result
+            return result
+        finally:
+            semaphore.release()
+
+    try:
+        async for chunk in chunks:
+            await semaphore.acquire()
+            if failed is not None:
+                # stop taking the chunks once a chunk is failed
+                semaphore.release()
+                break
+            futures.append(asyncio.ensure_future(consume(chunk)))
+
+        results = await asyncio.gather(*futures)
+        if isinstance(failed, Exception):
+            raise failed
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return failed, results
+
+
+async def stream_task(task: TaskSchema, context: dict, span: dict = None) -> dict:
+    """
+    Read the rows of sql in chunks and call the task once per chunk.
+    The result data is the list of the data of chunks in order.
+    """
+    stream = task.stream
+    source = get_stream_by_name(stream.package_name, stream.name)
+    if source is None:
+        raise ValueError(f"{stream.package_name}.{stream.name} is not a sql service")
+
+    start = time.perf_counter()
+    batches = source(**stream.kwargs, batch_size=stream.batch_size)
+    try:
+        failed, results = await call_in_chunks(task, context, batches, stream.argument, stream.concurrency)
+    finally:
+        # release the cursor if it stops early
+        await batches.aclose()
+
+    if span is not None:
+        span["execute_seconds"] = time.perf_counter() - start
+        span["chunks"] = len(results)
+    return map_output(failed or Result.success([x.data for x in results]), task.output, span)
+
+
+async def map_task(task: TaskSchema, context: dict, span: dict = None) -> dict:
+    """
+    Call the task for each item of a list in context, or for each batch of items if batch size is greater than 1.
+    The result data is the list of the data of calls in order, the data of a batch is flattened if it is a list,
+    so it is one to one with the items.
+    """
+    task_map = task.map
+    items = execute_inline_template(task_map.items, context)
+    if not isinstance(items, (list, tuple)):
+        raise ValueError(f"the items of map task '{task.id or task.name}' is not a list: {task_map.items}")
+
+    batch_size = max(task_map.batch_size, 1)
+
+    async def iterate():
+        if batch_size == 1:
+            for item in items:
+                yield item
+        else:
+            for i in range(0, len(items), batch_size):
+                yield list(items[i:i + batch_size])
+
+    start = time.perf_counter()
+    failed, results = await call_in_chunks(task, context, iterate(), task_map.argument, task_map.concurrency)
+    if span is not None:
+        span["execute_seconds"] = time.perf_counter() - start
+        span["chunks"] = len(results)
+    if failed is not None:
+        return map_output(failed, task.output, span)
+
+    data = []
+    for result in results:
+        if batch_size > 1 and isinstance(result.data, list):
+            data.extend(result.data)
+        else:
+            data.append(result.data)
+    return map_output(Result.success(data), task.output, span)
+
+
+def get_dependencies(task_configs: List[TaskSchema]) -> List[List[int]]:
+    """
+    Get the indexes of tasks which each task depends on.
+    The explicit depends are used if it is provided, otherwise the task depends on all tasks of the previous layer,
+    so its context is the outputs of the previous layer as the layered pipeline does.
+    """
+    ids: Dict[str, int] = {}
+    for i, task in enumerate(task_configs):
+        task_id = task.id or str(i)
+        if task_id in ids:
+            raise ValueError(f"duplicate task id '{task_id}'")
+        ids[task_id] = i
+
+    layers = sorted({x.layer for x in task_configs})
+    dependencies = []
+    for i, task in enumerate(task_configs):
+        if task.depends is not None:
+            unknown = [x for x in task.depends if x not in ids]
+            if unknown:
+                raise ValueError(f"task '{task.id or i}' depends on unknown tasks: {', '.join(unknown)}")
+            dependencies.append([ids[x] for x in task.depends])
+            continue
+
+        lower_layers = [x for x in layers if x < task.layer]
+        if not lower_layers:
+            dependencies.append([])
+            continue
+        dependencies.append([j for j, x in enumerate(task_configs) if x.layer == lower_layers[-1]])
+
+    return dependencies
+
+
+def get_topological_order(dependencies: List[List[int]]) -> List[int]:
+    order = []
+    state = [0] * len(dependencies)  # 0 is unvisited, 1 is visiting, 2 is visited
+
+    def visit(i: int):
+        if state[i] == 2:
+            return
+        if state[i] == 1:
+            raise ValueError("the dependencies of tasks have a cycle")
+        state[i] = 1
+        for j in dependencies[i]:
+            visit(j)
+        state[i] = 2
+        order.append(i)
+
+    for i in range(len(dependencies)):
+        visit(i)
+    return order
+
+
+async def execute_task(task: TaskSchema, context: dict, span: dict = None) -> dict:
+    if task.stream is not None:
+        return await stream_task(task, context, span)
+    if task.map is not None:
+        return await map_task(task, context, span)
+    return await wrap_task(task.package_name, task.name, task.kwargs, task.output, context, span)
+
+
+def merge_outputs(outputs: List[dict]) -> dict:
+    return {k: v for d in outputs for k, v in d.items()}
+
+
+def new_span(task_configs: List[TaskSchema], dependencies: List[List[int]], i: int) -> dict:
+    task = task_configs[i]
+    return {
+        "id": task.id or str(i),
+        "task": f"{task.package_name}.{task.name}",
+        "layer": task.layer,
+        "depends": [task_configs[j].id or str(j) for j in dependencies[i]],
+        "status": "pending",
+        "queued": None,
+        "started": None,
+        "finished": None,
+        "condition_seconds": 0.0,
+        "execute_seconds": 0.0,
+        "render_seconds": 0.0,
+        "result_size": 0,
+    }
+
+
+async def run(task_configs: List[TaskSchema], concurrency: int = 0, trace: Optional[list] = None):
+    """
+    Run the tasks of pipeline, each task starts as soon as the tasks it depends on are finished.
+    :param task_configs: The task inputs.
+    :param concurrency: The max number of tasks running at the same time, 0 means no limit.
+    :param trace: The list to collect the timeline of each task if it is provided, the times of
+        queued (dependencies finished), started (got a slot of concurrency) and finished are the seconds
+        since the pipeline starts.
+    :return: The merged outputs of the tasks which no other task depends on,
+        they are the tasks of the last layer if no task has explicit depends.
+    """
+    dependencies = get_dependencies(task_configs)
+    order = get_topological_order(dependencies)
+    semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+    futures: Dict[int, asyncio.Future] = {}
+    spans = [new_span(task_configs, dependencies, i) for i in range(len(task_configs))] if trace is not None else None
+    pipeline_start = time.perf_counter()
+
+    def elapsed() -> float:
+        return time.perf_counter() - pipeline_start
+
+    async def run_task(i: int) -> dict:
+        # the context is the outputs of the tasks it depends on
+        context = merge_outputs(await asyncio.gather(*[futures[j] for j in dependencies[i]]))
+        task = task_configs[i]
+        if spans is None:
+            if not execute_condition_template(task.condition, context):
+                return {}
+            if semaphore is None:
+                return await execute_task(task, context)
+            async with semaphore:
+                return await execute_task(task, context)
+
+        span = spans[i]
+        span["queued"] = elapsed()
+        try:
+            start = time.perf_counter()
+            matched = execute_condition_template(task.condition, context)
+            span["condition_seconds"] = time.perf_counter() - start
+            if not matched:
+                span["status"] = "skipped"
+                return {}
+
+            if semaphore is None:
+                span["started"] = elapsed()
+                outputs = await execute_task(task, context, span)
+            else:
+                async with semaphore:
+                    span["started"] = elapsed()
+                    outputs = await execute_task(task, context, span)
+            if span["status"] == "pending":
+                # the task without output is not executed
+                span["status"] = "skipped"
+            return outputs
+        except asyncio.CancelledError:
+            span["status"] = "cancelled"
+            raise
+        except Exception:
+            span["status"] = "error"
+            raise
+        finally:
+            span["finished"] = elapsed()
+
+    # the tasks are created in topological order, so the futures of dependencies always exist
+    for i in order:
+        futures[i] = asyncio.ensure_future(run_task(i))
+
+    try:
+        await asyncio.gather(*futures.values())
+    except BaseException:
+        for future in futures.values():
+            future.cancel()
+        raise
+    finally:
+        if spans is not None:
+            trace.extend(spans)
+            log_trace(spans, elapsed())
+
+    depended = {j for x in dependencies for j in x}
+    return merge_outputs([futures[i].result() for i in range(len(task_configs)) if i not in depended])
 
-        # update the context by the results of this layer
-        results = {k: v for d in results for k, v in d.items()}
 
-    return results
+def log_trace(spans: List[dict], seconds: float):
+    finished = [x for x in spans if x["started"] is not None and x["finished"] is not None]
+    slowest = sorted(finished, key=lambda x: x["finished"] - x["started"], reverse=True)[:3]
+    logger.info("pipeline finished in %.3fs, %s tasks, the slowest: %s", seconds, len(spans),
+                ", ".join(f"{x['id']}({x['task']}) {x['finished'] - x['started']:.3f}s" for x in slowest))
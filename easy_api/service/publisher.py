@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import queue
+import threading
+from typing import Any, Optional
+
+from easy_api.celery import app as celery_app
+
+logger = logging.getLogger("easy_api.publisher")
+
+class Publisher:
+    """
+    Send the tasks to broker in a dedicated thread, so the broker I/O never blocks the event loop.
+    The thread keeps one producer with a persistent connection, the tasks are sent one by one in order.
+    """
+
+    def __init__(self, app=celery_app):
+        self._app = app
+        self._queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.errors = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="easy_api_publisher", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """ stop the thread after the queued tasks were sent """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+            self._thread = None
+
+    def publish(self, task, args: list = None, kwargs: dict = None, **options: Any) -> asyncio.Future:
+        """
+        Send the task by apply_async in the publisher thread.
+        :return: the future of the AsyncResult of task
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.start()
+        self._queue.put((task, args, kwargs, options, loop, future))
+        return future
+
+    def _run(self):
+        producer = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+
+                task, args, kwargs, options, loop, future = item
+                try:
+                    if producer is None:
+                        producer = self._app.producer_pool.acquire(block=True)
+                    result = task.apply_async(args, kwargs, producer=producer, **options)
+                    self.published += 1
+                    loop.call_soon_threadsafe(_set_result, future, result)
+                except Exception as e:
+                    logger.warning("publish task %s error: %s", task.name, e)
+                    self.errors += 1
+                    loop.call_soon_threadsafe(_set_exception, future, e)
+                    # the connection may be broken, acquire a new producer for the next task
+                    if producer is not None:
+                        producer.release()
+                        producer = None
+        finally:
+            if producer is not None:
+                producer.release()
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "published": self.published, "errors": self.errors}
+
+
+def _set_result(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, e: Exception):
+    if not future.done():
+        future.set_exception(e)
+
+
+publisher = Publisher()
+
+
+async def publish(task, args: list = None, kwargs: dict = None, **options: Any):
+    """ send the task to broker without blocking the event loop """
+    return await publisher.publish(task, args, kwargs, **options)
@@ -7,6 +7,7 @@ from easy_api.errors import SQLExistsError, PackageNotFoundError
 from easy_api.service.files import copytree_and_render
 from easy_api.schema import get_json_schema
 from easy_api.service.package import exists_package
+from easy_api.service.paging import COUNT_MODES, parse_keyset, get_keyset_sql_jinja
 
 logger = logging.getLogger("easy_api.sql")
 
@@ -34,7 +35,7 @@ async def common_pre_checker(package_name: str, sql_name: str, overwrite: bool,
 async def create_sql(package_name: str, sql_name: str, nickname: str,
                      sql_jinja: str, method: str = "post",
                      database: str = "default", overwrite: bool = False,
-                     export_xlsx: Union[str, bool] = False):
+                     export_xlsx: Union[str, bool] = False, stream: bool = False, cache_ttl: int = 0):
     await common_pre_checker(package_name, sql_name, overwrite, database)
 
     package_path = os.path.join(configs.project_root, package_name)
@@ -51,6 +52,8 @@ async def create_sql(package_name: str, sql_name: str, nickname: str,
         "sql_jinja": sql_jinja,
         "sql_schema": get_json_schema(sql_jinja),
         "export_xlsx": export_xlsx,
+        "stream": stream,
+        "cache_ttl": cache_ttl,
     }
 
     await copytree_and_render(
@@ -61,7 +64,8 @@ async def create_sql(package_name: str, sql_name: str, nickname: str,
 
 
 async def create_pagination_sql(package_name: str, sql_name: str, nickname: str, sql_jinja: str, count_jinja: str,
-                                database: str = "default", overwrite: bool = False):
+                                database: str = "default", overwrite: bool = False, keyset: str = "",
+                                count_mode: str = "exact", count_ttl: int = 0):
     """
     Create a pagination sql file from a jinja template.
     :param package_name: The package name.
@@ -71,7 +75,13 @@ async def create_pagination_sql(package_name: str, sql_name: str, nickname: str,
     :param count_jinja: The count sql file content.
     :param database: The database name.
     :param overwrite: Overwrite the sql file if it already exists.
+    :param keyset: The ordering columns like "id" or "created_at desc, id desc", if provided,
+                   the pages are sought by the cursor of last row instead of offset.
+    :param count_mode: exact, estimate by the query plan, or none to skip count and return -1.
+    :param count_ttl: Cache the count of the same filter parameters for seconds, 0 means no cache.
     """
+    if count_mode not in COUNT_MODES:
+        raise ValueError(f"count mode must be one of {', '.join(COUNT_MODES)}")
     await common_pre_checker(package_name, sql_name, overwrite, database)
 
     package_path = os.path.join(configs.project_root, package_name)
@@ -79,12 +89,24 @@ async def create_pagination_sql(package_name: str, sql_name: str, nickname: str,
     if not os.path.isdir(template_path):
         raise ValueError("package sql_template not exist")
 
-    # add page and page_size to sql_jinja
-    paging_sql_jinja = "{% set _page = page|default(1) %} {% set _page_size = page_size|default(10) %}\n" \
-                       f"{sql_jinja}" \
-                       " limit {{ _page_size }} offset {{ _page_size * (_page - 1) }}"
-
-    if count_jinja is True:
+    keyset_columns = []
+    if keyset:
+        keyset_columns, _ = parse_keyset(keyset)
+        paging_sql_jinja = get_keyset_sql_jinja(sql_jinja, keyset)
+        # the cursor is decoded to KEYSET_CURSOR by service, so the request schema takes it as a string
+        schema_jinja = "{% set _page_size = page_size|default(10) %} {% set _cursor = cursor|default('') %}\n" \
+                       f"{sql_jinja}"
+    else:
+        # add page and page_size to sql_jinja, it fetches one more row to know whether there is a next page
+        paging_sql_jinja = "{% set _page = page|default(1) %} {% set _page_size = page_size|default(10) %}\n" \
+                           f"{sql_jinja}" \
+                           " limit {{ _page_size + 1 }} offset {{ _page_size * (_page - 1) }}"
+        schema_jinja = paging_sql_jinja
+
+    if count_mode == "estimate":
+        # the service estimates the count of sql by the query plan
+        count_jinja = sql_jinja
+    elif count_jinja is True:
         # wrap sql to count sql
         count_jinja = f"select count(*) as `count` from ({sql_jinja}) as _count"
 
@@ -96,7 +118,10 @@ async def create_pagination_sql(package_name: str, sql_name: str, nickname: str,
         "sql_jinja": sql_jinja,
         "paging_sql_jinja": paging_sql_jinja,
         "count_jinja": count_jinja,
-        "sql_schema": get_json_schema(paging_sql_jinja),
+        "sql_schema": get_json_schema(schema_jinja),
+        "keyset_columns": keyset_columns,
+        "count_mode": count_mode,
+        "count_ttl": count_ttl,
     }
 
     await copytree_and_render(
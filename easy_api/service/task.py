@@ -1,18 +1,24 @@
+import asyncio
 import functools
 import logging
+import multiprocessing
 import os
 from asyncio import Future
-from typing import Awaitable, Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Union
 
 from kombu import uuid
 
-from easy_api.service import celery_waiter
+from easy_api.service import cache, celery_waiter, payload
 from easy_api import configs
-from easy_api.errors import PackageNotFoundError, TaskExistsError
+from easy_api.celery import app
+from easy_api.errors import PackageNotFoundError, TaskExistsError, TaskTimeoutError
 from easy_api.service.files import copytree_and_render
 from easy_api.schema import Result
 from easy_api.service.package import exists_package
-from easy_api.tasks import invoke_task
+from easy_api.service.publisher import publish
+from easy_api.tasks import call_task, init_worker_process, invoke_task
 
 logger = logging.getLogger("easy_api.task")
 
@@ -67,23 +73,171 @@ async def delete_task(package_name: str, task_name: str):
             os.remove(file_path)
 
 
-def run_in_worker(package_name: str, task_name: str) -> Callable[[str, str], Callable[[callable], Awaitable[Result]]]:
+def revoke_task(task_id: str):
+    """ revoke the task in background, the task is discarded if it has not been started by worker """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, functools.partial(app.control.revoke, task_id))
+    future.add_done_callback(lambda f: f.exception() and logger.warning("revoke task %s error: %s",
+                                                                         task_id, f.exception()))
+
+
+async def run_in_celery(package_name: str, task_name: str, args: tuple, kwargs: dict, timeout: float) -> dict:
+    """ send the task to celery worker and wait its result, the task is revoked if it is timeout or cancelled """
+    worker_task_id = uuid()
+    future = Future()
+    loop = asyncio.get_running_loop()
+
+    task_args = [package_name, task_name, args, kwargs]
+    if payload.get_store() is not None:
+        # the large arguments are passed by reference, so the broker message stays small
+        value = await loop.run_in_executor(None, payload.offload, (args, kwargs))
+        if payload.is_reference(value):
+            task_args = [package_name, task_name, value, {}]
+
+    options = {"reply_to": celery_waiter.reply_to} if celery_waiter.reply_to else {}
+    try:
+        await celery_waiter.wait_result(worker_task_id, future)
+        await publish(invoke_task, args=task_args, task_id=worker_task_id,
+                      ignore_result=False, expires=timeout or None, **options)
+        task_result = await asyncio.wait_for(future, timeout or None)
+        if payload.is_reference(task_result):
+            task_result = await loop.run_in_executor(None, payload.load, task_result, True)
+        return task_result
+    except asyncio.TimeoutError:
+        celery_waiter.stats["timeouts"] += 1
+        revoke_task(worker_task_id)
+        raise
+    except asyncio.CancelledError:
+        # the client is disconnected
+        celery_waiter.stats["cancellations"] += 1
+        revoke_task(worker_task_id)
+        raise
+    finally:
+        await celery_waiter.forget(worker_task_id)
+        if payload.is_reference(task_args[2]):
+            loop.run_in_executor(None, payload.discard, task_args[2])
+
+
+executors: Dict[str, Executor] = {}
+
+
+def get_executor(backend: str) -> Executor:
+    """ get the local pool of the executor backend, process or thread """
+    if backend not in executors:
+        max_workers = configs.executor.max_workers or None
+        if backend == "process":
+            # fork is not safe in the server which runs several threads, the spawned workers load the config again
+            executors[backend] = ProcessPoolExecutor(max_workers=max_workers,
+                                                     mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=init_worker_process, initargs=(configs.config_file,))
+        elif backend == "thread":
+            executors[backend] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="easy_api_task")
+        else:
+            raise ValueError(f"Executor backend '{backend}' not supported.")
+    return executors[backend]
+
+
+def shutdown_executors():
+    for executor in executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    executors.clear()
+
+
+async def run_in_executor(backend: str, package_name: str, task_name: str, args: tuple, kwargs: dict,
+                          timeout: float) -> dict:
+    """ run the task in the local pool, the task is cancelled if it has not been started when timeout """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(get_executor(backend), call_task, package_name, task_name, args, kwargs)
+    return await asyncio.wait_for(future, timeout or None)
+
+
+@dataclass(frozen=True)
+class TaskCache:
+    """ The cache of task results, the task must be a pure function of its arguments """
+    # cache the successful result for seconds
+    ttl: int
+    # the function over args and kwargs to get the cache key, default is all of the arguments
+    key: Callable[..., Any] = None
+
+    def get_key(self, package_name: str, task_name: str, args: tuple, kwargs: dict) -> str:
+        parts = self.key(*args, **kwargs) if self.key else (args, sorted(kwargs.items()))
+        return cache.make_key("task", package_name, task_name, parts)
+
+
+task_flight = cache.SingleFlight()
+task_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+async def cached_call(task_cache: TaskCache, key: str, func: Callable[[], Awaitable[Result]]) -> Result:
+    """ get the result from cache, or call func and cache the successful result """
+    backend = cache.get_backend()
+    result = await backend.get(key)
+    if result is not None:
+        task_cache_stats["hits"] += 1
+        return result
+
+    task_cache_stats["misses"] += 1
+    result = await func()
+    if result.code == 0:
+        await backend.set(key, result, ttl=task_cache.ttl)
+    return result
+
+
+def get_task_cache_stats() -> dict:
+    return {**task_cache_stats, **task_flight.stats()}
+
+
+def run_in_worker(package_name: str, task_name: str, timeout: float = None, executor: str = None,
+                  task_cache: Union[int, TaskCache] = None
+                  ) -> Callable[[str, str], Callable[[callable], Awaitable[Result]]]:
+    """
+    Run the function in celery worker or local pool and wait its result.
+    :param package_name: The package name.
+    :param task_name: The task name.
+    :param timeout: The seconds to wait the result, the task is revoked after that,
+                    default is the task_timeout of celery config, 0 means never timeout.
+    :param executor: celery, process or thread, default is the backend of executor config.
+    :param task_cache: The seconds to cache the successful result by all of the arguments, or a TaskCache,
+                       0 means no cache, the concurrent calls with the same key share one execution.
+    """
+    if isinstance(task_cache, bool):
+        raise ValueError("task_cache must be the seconds or a TaskCache")
+    result_cache = TaskCache(ttl=task_cache) if isinstance(task_cache, int) else task_cache
+    if result_cache is not None and not result_cache.ttl:
+        # the backend keeps the entry of ttl 0 forever
+        result_cache = None
+
     def _(func) -> Callable[[callable], Awaitable[Result]]:
-        @functools.wraps(func)
-        async def _fun_in_worker(*args, **kwargs):
-            worker_task_id = uuid()
-            future = Future()
+        async def _run(args: tuple, kwargs: dict) -> Result:
+            _timeout = configs.celery.task_timeout if timeout is None else timeout
+            backend = executor or configs.executor.backend
+            try:
+                if backend == "celery":
+                    task_result = await run_in_celery(package_name, task_name, args, kwargs, _timeout)
+                else:
+                    task_result = await run_in_executor(backend, package_name, task_name, args, kwargs, _timeout)
+            except asyncio.TimeoutError:
+                return TaskTimeoutError().format(task_name=f"{package_name}.{task_name}",
+                                                 timeout=_timeout).to_result()
 
-            celery_waiter.wait_result(worker_task_id, future)
-            invoke_task.apply_async(args=[package_name, task_name, args, kwargs], task_id=worker_task_id,
-                                    ignore_result=False)
-            celery_result = await future
             result = Result()
-            result.code = celery_result["code"]
-            result.data = celery_result["data"]
-            result.msg = celery_result["msg"]
+            result.code = task_result["code"]
+            result.data = task_result["data"]
+            result.msg = task_result["msg"]
             return result
 
+        @functools.wraps(func)
+        async def _fun_in_worker(*args, **kwargs):
+            if result_cache is None:
+                return await _run(args, kwargs)
+
+            key = result_cache.get_key(package_name, task_name, args, kwargs)
+            return await task_flight.do(
+                key, functools.partial(cached_call, result_cache, key, functools.partial(_run, args, kwargs)))
+
         return _fun_in_worker
 
     return _
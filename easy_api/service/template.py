@@ -1,9 +1,29 @@
-from typing import Tuple
+import functools
+from typing import Tuple, Dict
 
+from jinja2 import Template
 from jinjasql import JinjaSql
 
 from easy_api.service.files import read_file
 
+# the max number of compiled templates to keep in memory
+TEMPLATE_CACHE_SIZE = 256
+
+jinja_sqls: Dict[str, JinjaSql] = {}
+
+
+def get_jinja_sql(param_style: str = "qmark") -> JinjaSql:
+    """ get the shared JinjaSql of the param style """
+    if param_style not in jinja_sqls:
+        jinja_sqls[param_style] = JinjaSql(param_style=param_style)
+    return jinja_sqls[param_style]
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(text: str, param_style: str = "qmark") -> Template:
+    """ compile the text to template with cache, the same text only be compiled once """
+    return get_jinja_sql(param_style).env.from_string(text)
+
 
 async def render_template(template_path: str, params: dict) -> Tuple[str, list]:
     template = await read_file(template_path)
@@ -11,6 +31,6 @@ async def render_template(template_path: str, params: dict) -> Tuple[str, list]:
 
 
 async def render_string(text: str, params: dict) -> Tuple[str, list]:
-    j = JinjaSql(param_style="qmark")
-    query, bind_params = j.prepare_query(text, params)
+    j = get_jinja_sql("qmark")
+    query, bind_params = j.prepare_query(compile_template(text, "qmark"), params)
     return query, bind_params
@@ -1,21 +1,84 @@
 import logging
+import time
 from dataclasses import asdict
 from importlib import import_module
+from types import ModuleType
+from typing import Callable, Dict, Tuple
 
 from celery import shared_task
 
+from easy_api import configs
+from easy_api.schema import Result
+from easy_api.seeker import walk_apps
+from easy_api.service import payload
+
 logger = logging.getLogger("easy_api.queue")
 
+# the run functions of services, the key is (package_name, name)
+registry: Dict[Tuple[str, str], Callable] = {}
+# the imported modules of services, the key is (package_name, name)
+modules: Dict[Tuple[str, str], ModuleType] = {}
+# the seconds of importing each service module
+import_seconds: Dict[str, float] = {}
+
+
+def register_task(package_name: str, name: str):
+    module_name = f'{package_name}.service.{name}'
+    start = time.perf_counter()
+    module = import_module(module_name)
+    import_seconds[module_name] = time.perf_counter() - start
+    modules[(package_name, name)] = module
+
+    task = getattr(module, 'run', None)
+    if task is not None:
+        registry[(package_name, name)] = task
+    return task
+
+
+def load_registry():
+    """
+    Import the services of every app eagerly, so the worker is warm before it accepts jobs.
+    """
+    for path in walk_apps('service'):
+        module_name = path[:-3].replace('/', '.')
+        if '.service.' not in module_name or module_name.endswith('__init__'):
+            continue
+
+        package_name, name = module_name.split('.service.', 1)
+        try:
+            register_task(package_name, name)
+        except Exception as e:
+            logger.exception("import %s error: %s", module_name, e)
+
+    slowest = sorted(import_seconds.items(), key=lambda x: x[1], reverse=True)[:5]
+    logger.info("registered %s tasks, the slowest imports: %s", len(registry),
+                ", ".join(f"{k} {v:.3f}s" for k, v in slowest))
+
 
 def get_task_by_name(package_name, name):
-    module = import_module(f'{package_name}.service.{name}')
-    return getattr(module, 'run', None)
+    task = registry.get((package_name, name))
+    if task is None:
+        # the task is created after the registry was loaded
+        task = register_task(package_name, name)
+    return task
 
 
-@shared_task
-def invoke_task(package_name, task_name, args, kwargs):
+def get_stream_by_name(package_name, name):
+    """ get the run_stream function of a sql service, which yields the rows in batches """
+    module = modules.get((package_name, name))
+    if module is None:
+        register_task(package_name, name)
+        module = modules[(package_name, name)]
+    return getattr(module, 'run_stream', None)
+
+
+def get_registry_stats() -> dict:
+    return {"tasks": len(registry), "import_seconds": dict(import_seconds)}
+
+
+def call_task(package_name, task_name, args, kwargs):
     """
-    Invoke a task in a package.
+    Call a task in a package in this process, it is shared by celery worker and the local executors.
     """
     task = get_task_by_name(package_name, task_name)
     if task is None:
@@ -27,3 +90,26 @@ def invoke_task(package_name, task_name, args, kwargs):
         return asdict(result)
     except Exception as e:
         logger.exception(e)
+
+
+def init_worker_process(config_file):
+    """ the initializer of the process executor, the spawned process needs to load the config """
+    if configs.config_file != config_file:
+        configs.install(config_file)
+    load_registry()
+
+
+@shared_task
+def invoke_task(package_name, task_name, args, kwargs):
+    """
+    Invoke a task in a package.
+    """
+    if payload.is_reference(args):
+        # the large arguments are passed by reference, the server removes them after the result arrives
+        try:
+            args, kwargs = payload.load(args)
+        except Exception as e:
+            # the payload may be expired, the server expects a result rather than a failed task
+            logger.warning("load the arguments of %s.%s error: %s", package_name, task_name, e)
+            return asdict(Result.error(e))
+    return payload.offload(call_task(package_name, task_name, args, kwargs))
@@ -88,6 +88,12 @@ def setup_sqlite():
         loop.run_until_complete(drop_test_table_in_sqlite(sqlite_db))
 
 
+@pytest.fixture(scope="session", autouse=True)
+def close_db_pools():
+    yield
+    asyncio.get_event_loop().run_until_complete(db.close_pools())
+
+
 @pytest.fixture(scope="module", autouse=True)
 def clean_sqlite_file():
     yield
@@ -0,0 +1,147 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from aiocache import Cache
+from aiocache.serializers import PickleSerializer
+
+from easy_api.service import cache, db
+from easy_api.service.cache import MemoryBackend, get_tables
+
+DB_NAME = "easy_api_test"
+
+
+@pytest.mark.parametrize(["sql", "expect"], (
+        ("select * from company", ["company"]),
+        ("select * from `company` c left join dept as d on c.id = d.id", ["company", "dept"]),
+        ("insert into company (name) values (?)", ["company"]),
+        ("update company set age = ?", ["company"]),
+        ("delete from main.company where id = ?", ["main.company"]),
+        ("select 1", []),
+        ("select * from a, b where a.id = b.id", ["a", "b"]),
+        ("select * from `a` as x,b y, c\nwhere x.id in (1, 2)", ["a", "b", "c"]),
+        ("select * from a x, b join c on b.id = c.id", ["a", "b", "c"]),
+        ("select * from a where id in (select id from b, c)", ["a", "b", "c"]),
+        ("select * from a left join b using (id) order by a.id", ["a", "b"]),
+))
+def test_get_tables(sql, expect):
+    assert get_tables(sql) == expect
+
+
+async def test_memory_backend_lru():
+    backend = MemoryBackend(maxsize=2)
+    await backend.set("a", 1)
+    await backend.set("b", 2)
+    assert await backend.get("a") == 1
+    await backend.set("c", 3)
+
+    assert await backend.get("b") is None
+    assert await backend.get("a") == 1
+    assert await backend.get("c") == 3
+
+
+async def test_memory_backend_ttl():
+    backend = MemoryBackend()
+    await backend.set("a", 1, ttl=-1)
+    assert await backend.get("a") is None
+
+
+@pytest.mark.usefixtures("setup_sqlite")
+async def test_cached_query_invalidated_by_write():
+    await cache.get_backend().clear()
+    query = f"select name from {DB_NAME} where age = ?"
+    hits, misses = cache.stats["hits"], cache.stats["misses"]
+
+    result = await db.execute("sqlite", query, [30], cache_ttl=60)
+    assert result["result"] == [{"name": "Mary"}]
+    result = await db.execute("sqlite", query, [30], cache_ttl=60)
+    assert result["result"] == [{"name": "Mary"}]
+    assert cache.stats["hits"] - hits == 1
+    assert cache.stats["misses"] - misses == 1
+
+    await db.execute("sqlite", f"update {DB_NAME} set age = ? where name = ?", [31, "Mary"])
+    result = await db.execute("sqlite", query, [30], cache_ttl=60)
+    assert result["result"] == []
+    assert cache.stats["misses"] - misses == 2
+
+
+async def test_cached_query_with_aiocache_backend():
+    backend = Cache(Cache.MEMORY, serializer=PickleSerializer())
+    calls = 0
+
+    async def query():
+        nonlocal calls
+        calls += 1
+        return {"result": [calls]}
+
+    with patch.object(cache, "_backend", backend):
+        sql = "select * from company"
+        assert await cache.cached_query("sqlite", sql, [], 60, query) == {"result": [1]}
+        assert await cache.cached_query("sqlite", sql, [], 60, query) == {"result": [1]}
+
+        await cache.invalidate_query("sqlite", "update company set age = 1")
+        assert await cache.cached_query("sqlite", sql, [], 60, query) == {"result": [2]}
+        assert await cache.cached_query("sqlite", sql, [], 60, query) == {"result": [2]}
+
+
+@pytest.mark.usefixtures("setup_sqlite")
+async def test_read_after_write_not_coalesced():
+    query = f"select age from {DB_NAME} where name = ?"
+    execute_read = db.execute_read
+    release = asyncio.Event()
+    calls = 0
+
+    async def slow_read(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        result = await execute_read(*args, **kwargs)
+        if calls == 1:
+            # the first read got the rows before the write, and it is still in flight
+            await release.wait()
+        return result
+
+    with patch.object(db, "execute_read", slow_read):
+        before = asyncio.ensure_future(db.execute("sqlite", query, ["Mary"]))
+        await asyncio.sleep(0.01)
+        await db.execute("sqlite", f"update {DB_NAME} set age = ? where name = ?", [31, "Mary"])
+        after = asyncio.ensure_future(db.execute("sqlite", query, ["Mary"]))
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert (await before)["result"] == [{"age": 30}]
+        assert (await after)["result"] == [{"age": 31}]
+    assert calls == 2
+
+
+async def test_single_flight_coalesce():
+    flight = cache.SingleFlight()
+    call_count = 0
+    event = asyncio.Event()
+
+    async def query():
+        nonlocal call_count
+        call_count += 1
+        await event.wait()
+        return {"result": [1]}
+
+    waiters = [asyncio.ensure_future(flight.do("key", query)) for _ in range(3)]
+    await asyncio.sleep(0)
+    waiters[0].cancel()
+    event.set()
+
+    results = await asyncio.gather(*waiters[1:])
+    assert results == [{"result": [1]}, {"result": [1]}]
+    assert results[0] is results[1]
+    assert call_count == 1
+    assert flight.stats() == {"in_flight": 0, "coalesced": 2}
+
+
+async def test_single_flight_exception():
+    flight = cache.SingleFlight()
+
+    async def query():
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        await flight.do("key", query)
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,182 @@
+import asyncio
+import dataclasses
+from contextlib import asynccontextmanager
+
+import msgpack
+import pytest
+from celery import Celery
+
+from easy_api.service import celery_waiter
+
+
+class FakePubSub:
+
+    def __init__(self):
+        self.channels = set()
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel):
+        self.channels.discard(channel)
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=10.0):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout=0.01)
+        except asyncio.TimeoutError:
+            return None
+
+    def publish(self, task_id, status, result=None):
+        data = msgpack.packb({"task_id": task_id, "status": status, "result": result})
+        self.messages.put_nowait({"type": "message", "data": data})
+
+
+@pytest.fixture
+def waiter(monkeypatch):
+    monkeypatch.setattr(celery_waiter, "has_waiter", asyncio.Event())
+    monkeypatch.setattr(celery_waiter, "waiter", {})
+    monkeypatch.setattr(celery_waiter, "is_redis_backend", True)
+    monkeypatch.setattr(celery_waiter, "pubsub", None)
+    return celery_waiter
+
+
+@asynccontextmanager
+async def watching():
+    p = FakePubSub()
+    task = asyncio.ensure_future(celery_waiter.watch(p))
+    await asyncio.sleep(0)
+    try:
+        yield p
+    finally:
+        task.cancel()
+
+
+async def test_wait_result_not_started(waiter, monkeypatch):
+    with pytest.raises(RuntimeError):
+        await waiter.wait_result("task", asyncio.get_running_loop().create_future())
+
+    monkeypatch.setattr(celery_waiter, "has_waiter", None)
+    with pytest.raises(RuntimeError):
+        await waiter.wait_result("task", asyncio.get_running_loop().create_future())
+
+
+async def test_watch_result(waiter):
+    future = asyncio.get_running_loop().create_future()
+    async with watching() as pubsub:
+        await waiter.wait_result("task", future)
+        assert pubsub.channels == {"celery-task-meta-task"}
+
+        pubsub.publish("task", "STARTED")
+        await asyncio.sleep(0.05)
+        assert not future.done()
+        assert "task" in waiter.waiter
+
+        pubsub.publish("task", "SUCCESS", {"code": 0, "msg": "", "data": 42})
+        assert await asyncio.wait_for(future, 1) == {"code": 0, "msg": "", "data": 42}
+        assert pubsub.channels == set()
+        assert waiter.waiter == {}
+        assert waiter.get_stats()["outstanding"] == 0
+
+
+async def test_forget(waiter):
+    future = asyncio.get_running_loop().create_future()
+    async with watching() as pubsub:
+        await waiter.wait_result("task", future)
+        await waiter.forget("task")
+        assert pubsub.channels == set()
+        assert waiter.waiter == {}
+
+        # the late result of the forgotten task is ignored
+        pubsub.publish("task", "SUCCESS", 42)
+        await asyncio.sleep(0.05)
+        assert not future.done()
+
+
+class FakeKeyValueBackend:
+
+    def __init__(self, metas: dict):
+        self.metas = metas
+        self.mget_calls = []
+
+    def get_key_for_task(self, task_id):
+        return f"celery-task-meta-{task_id}"
+
+    def mget(self, keys):
+        self.mget_calls.append(keys)
+        return [self.metas.get(x[len("celery-task-meta-"):]) for x in keys]
+
+    def decode_result(self, value):
+        return value
+
+
+class FakeBackend:
+
+    def __init__(self, metas: dict):
+        self.metas = metas
+
+    def get_task_meta(self, task_id):
+        return self.metas.get(task_id, {"status": "PENDING", "result": None})
+
+
+class FakeApp:
+
+    def __init__(self, backend):
+        self.backend = backend
+
+
+@pytest.fixture
+def poll_waiter(waiter, monkeypatch):
+    monkeypatch.setattr(celery_waiter, "is_redis_backend", False)
+    monkeypatch.setattr(celery_waiter.configs, "celery",
+                        dataclasses.replace(celery_waiter.configs.celery, result_poll_interval=0.01))
+    return waiter
+
+
+@asynccontextmanager
+async def polling(backend, monkeypatch):
+    monkeypatch.setattr(celery_waiter, "app", FakeApp(backend))
+    task = asyncio.ensure_future(celery_waiter.start_poll())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+@pytest.mark.parametrize("backend_class", (FakeKeyValueBackend, FakeBackend))
+async def test_poll_result(poll_waiter, monkeypatch, backend_class):
+    metas = {"done": {"status": "SUCCESS", "result": 42}, "running": {"status": "STARTED", "result": None}}
+    backend = backend_class(metas)
+    loop = asyncio.get_running_loop()
+    futures = {x: loop.create_future() for x in ("done", "running", "pending")}
+
+    async with polling(backend, monkeypatch):
+        for task_id, future in futures.items():
+            await poll_waiter.wait_result(task_id, future)
+
+        assert await asyncio.wait_for(futures["done"], 1) == 42
+        await asyncio.sleep(0.05)
+        assert not futures["running"].done()
+        assert not futures["pending"].done()
+        assert set(poll_waiter.waiter) == {"running", "pending"}
+
+        metas["running"] = {"status": "FAILURE", "result": {"exc_message": "broken"}}
+        assert await asyncio.wait_for(futures["running"], 1) == {"exc_message": "broken"}
+        await poll_waiter.forget("pending")
+        assert poll_waiter.waiter == {}
+
+    if backend_class is FakeKeyValueBackend:
+        # the metas of all waited tasks are got in one round trip
+        assert sorted(backend.mget_calls[0]) == [f"celery-task-meta-{x}" for x in ("done", "pending", "running")]
+
+
+def test_get_reply_to(monkeypatch):
+    app = Celery("test", backend="rpc://", broker="memory://")
+    monkeypatch.setattr(celery_waiter, "app", app)
+    # the rpc backend of the poll thread receives the results on the queue of the poll thread
+    reply_to = celery_waiter.poll_executor.submit(celery_waiter.get_reply_to).result()
+    assert reply_to == celery_waiter.poll_executor.submit(lambda: app.thread_oid).result()
+    assert reply_to != app.thread_oid
+
+    monkeypatch.setattr(celery_waiter, "app", FakeApp(FakeBackend({})))
+    assert celery_waiter.get_reply_to() is None
@@ -2,6 +2,7 @@ from unittest import TestCase
 
 import pytest
 
+from easy_api.configs import get_database_cell
 from easy_api.service import db
 
 DB_NAME = "easy_api_test"
@@ -75,3 +76,67 @@ async def test_mysql_datetime():
     query = f"select now() as now"
     result = await db.execute("mysql", query)
     assert isinstance(result["result"][0]["now"], str)
+
+
+@pytest.mark.usefixtures("setup_sqlite")
+async def test_sqlite_reuse_pool_connection():
+    await db.execute("sqlite", f"select name from {DB_NAME}")
+    pool = db.pools["sqlite"]
+    conn = pool._free[0]
+
+    await db.execute("sqlite", f"select name from {DB_NAME}")
+    assert db.pools["sqlite"] is pool
+    assert list(pool._free) == [conn]
+
+
+@pytest.mark.usefixtures("setup_sqlite")
+async def test_sqlite_rollback_without_autocommit():
+    result = await db.execute("sqlite", f"delete from {DB_NAME}", autocommit=False)
+    assert result["changes"] == 4
+
+    result = await db.execute("sqlite", f"select name from {DB_NAME}")
+    assert len(result["result"]) == 4
+
+
+@pytest.mark.usefixtures("setup_sqlite")
+async def test_sqlite_stream_in_batches():
+    batches = []
+    async for rows in db.execute_stream("sqlite", f"select name from {DB_NAME} where age < ?", [30], batch_size=2):
+        batches.append(rows)
+
+    assert batches == [[{"name": "John"}, {"name": "Wick"}], [{"name": "Peter"}]]
+
+
+def test_choose_replica_instance():
+    primary = get_database_cell({
+        "name": "replica_test", "type": "sqlite", "db": "primary.db",
+        "replicas": [{"db": "replica0.db"}, {"db": "replica1.db"}],
+    })
+    replica0, replica1 = primary.replicas
+    assert replica0.name == "replica_test:replica0"
+    assert replica0.type == "sqlite"
+
+    assert db.choose_instance(primary, read_only=False) is primary
+    assert [db.choose_instance(primary, read_only=True) for _ in range(3)] == [replica0, replica1, replica0]
+
+    db.get_replica_state(replica0).healthy = False
+    try:
+        assert db.choose_instance(primary, read_only=True) is replica1
+        db.get_replica_state(replica1).healthy = False
+        assert db.choose_instance(primary, read_only=True) is primary
+    finally:
+        db.replica_states.clear()
+
+
+def test_choose_least_outstanding_replica():
+    primary = get_database_cell({
+        "name": "replica_test", "type": "sqlite", "db": "primary.db", "replica_strategy": "least_outstanding",
+        "replicas": [{"db": "replica0.db"}, {"db": "replica1.db"}],
+    })
+    replica0, replica1 = primary.replicas
+
+    db.get_replica_state(replica0).outstanding = 2
+    try:
+        assert db.choose_instance(primary, read_only=True) is replica1
+    finally:
+        db.replica_states.clear()
@@ -0,0 +1,93 @@
+from abc import ABC
+from io import BytesIO
+
+import pytest
+import tornado.httpclient
+import tornado.web
+from openpyxl import load_workbook
+
+from easy_api.service.export import export_xlsx_stream, export_stream, get_export_format
+from easy_api.web import Handler
+
+
+closed = []
+
+
+async def batches(*items):
+    try:
+        for rows in items:
+            yield rows
+    finally:
+        closed.append(items)
+
+
+class ExportHandler(Handler, ABC):
+
+    async def get(self, export_format: str):
+        stream = batches([{"name": "Duo", "age": 18}], [], [{"name": "Bing", "age": 19}])
+        if export_format == "broken":
+            # the writer fails at the bad row before the batches were consumed
+            await export_xlsx_stream(self, batches([{"name": "Duo"}, None], [{"name": "Bing"}]), "demo")
+        elif export_format == "xlsx":
+            await export_xlsx_stream(self, stream, "demo", self.get_argument("fields", None))
+        else:
+            await export_stream(self, export_format, stream, "demo", self.get_argument("fields", None))
+
+
+@pytest.fixture
+def app():
+    return tornado.web.Application([
+        (r"/export\.(\w+)", ExportHandler),
+    ])
+
+
+def read_xlsx(body: bytes) -> list:
+    ws = load_workbook(BytesIO(body), read_only=True).active
+    return [[x.value for x in row] for row in ws.iter_rows()]
+
+
+@pytest.mark.parametrize(["fields", "expect"], (
+        ("", [["name", "age"], ["Duo", "18"], ["Bing", "19"]]),
+        ("name:名称", [["名称"], ["Duo"], ["Bing"]]),
+))
+async def test_export_xlsx_stream(http_server_client, fields, expect):
+    response = await http_server_client.fetch(f'/export.xlsx?fields={fields}')
+    assert response.headers["Content-Disposition"] == "attachment; filename=demo.xlsx"
+    assert read_xlsx(response.body) == expect
+
+
+async def test_export_xlsx_stream_close_batches(http_server_client):
+    closed.clear()
+    with pytest.raises(tornado.httpclient.HTTPClientError):
+        await http_server_client.fetch('/export.broken')
+    assert closed == [([{"name": "Duo"}, None], [{"name": "Bing"}])]
+
+
+@pytest.mark.parametrize(["export_format", "fields", "expect"], (
+        ("csv", "", b"name,age\r\nDuo,18\r\nBing,19\r\n"),
+        ("csv", "name:名称", "名称\r\nDuo\r\nBing\r\n".encode()),
+        ("ndjson", "", b'{"name":"Duo","age":18}\n{"name":"Bing","age":19}\n'),
+        ("ndjson", "age:AGE", b'{"AGE":18}\n{"AGE":19}\n'),
+))
+async def test_export_text_stream(http_server_client, export_format, fields, expect):
+    response = await http_server_client.fetch(f'/export.{export_format}?fields={fields}')
+    assert response.headers["Content-Disposition"] == f"attachment; filename=demo.{export_format}"
+    assert response.body == expect
+
+
+@pytest.mark.parametrize(["accept", "expect"], (
+        (None, None),
+        ("application/json", None),
+        ("text/csv", "csv"),
+        ("application/json;q=0.9, application/x-ndjson", "ndjson"),
+        ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+        ("application/json, text/csv;q=0.5", None),
+        ("text/csv, application/json", None),
+        ("text/csv;q=0.5, */*;q=0.1", "csv"),
+        ("text/csv;q=0.5, application/x-ndjson;q=0.8, application/json;q=0.2", "ndjson"),
+        ("text/html, */*;q=0.8", None),
+        ("text/csv;q=0", None),
+        ("text/csv;q=bad", None),
+))
+def test_get_export_format(accept, expect):
+    assert get_export_format(accept) == expect
@@ -0,0 +1,28 @@
+import pytest
+
+from easy_api.service.paging import parse_keyset, encode_cursor, decode_cursor, get_keyset_sql_jinja
+
+
+def test_parse_keyset():
+    assert parse_keyset("id") == (["id"], False)
+    assert parse_keyset("created_at desc, id DESC") == (["created_at", "id"], True)
+
+    for keyset in ("created_at desc, id", "id; drop table t", "id up", ""):
+        with pytest.raises(ValueError):
+            parse_keyset(keyset)
+
+
+def test_cursor():
+    cursor = encode_cursor(["2023-01-01 00:00:00", 10])
+    assert decode_cursor(cursor, 2) == ["2023-01-01 00:00:00", 10]
+
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, 1)
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor", 2)
+
+
+def test_keyset_sql_jinja():
+    sql_jinja = get_keyset_sql_jinja("select * from t", "age desc, id desc")
+    assert "where (age, id) < ({{ KEYSET_CURSOR[0] }}, {{ KEYSET_CURSOR[1] }})" in sql_jinja
+    assert sql_jinja.endswith("order by age desc, id desc limit {{ _page_size + 1 }}")
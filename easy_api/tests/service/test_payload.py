@@ -0,0 +1,51 @@
+import dataclasses
+import os
+
+import pytest
+
+from easy_api import configs, tasks
+from easy_api.service import payload
+
+
+@pytest.fixture
+def file_store(tmp_path):
+    origin = configs.celery
+    configs.celery = dataclasses.replace(origin, payload_store=f"file://{tmp_path}", payload_threshold=100)
+    try:
+        yield tmp_path
+    finally:
+        configs.celery = origin
+
+
+def test_small_payload_is_inline(file_store):
+    value = (["Duo"], {"age": 18})
+    assert payload.offload(value) is value
+    assert os.listdir(file_store) == []
+
+
+def test_large_payload_by_reference(file_store):
+    value = ([{"name": "Duo"}] * 100, {})
+    reference = payload.offload(value)
+    assert payload.is_reference(reference)
+    assert len(os.listdir(file_store)) == 1
+
+    assert payload.load(reference) == value
+    payload.discard(reference)
+    assert os.listdir(file_store) == []
+
+    with pytest.raises(ValueError):
+        payload.load(reference)
+
+
+def test_without_store():
+    value = ([{"name": "Duo"}] * 100000, {})
+    assert payload.offload(value) is value
+
+
+def test_invoke_task_with_expired_payload(file_store):
+    reference = payload.offload(([{"name": "Duo"}] * 100, {}))
+    payload.discard(reference)
+
+    result = tasks.invoke_task("easy_api", "pipeline", reference, {})
+    assert result["code"] == -1
+    assert "expired" in result["msg"]
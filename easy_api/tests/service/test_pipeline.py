@@ -1,10 +1,12 @@
+import asyncio
 from unittest.mock import patch
 
 import pytest
 
-from easy_api.handler.schema.pipeline import TaskSchema
+from easy_api.handler.schema.pipeline import TaskSchema, StreamSchema, MapSchema
 from easy_api.schema import Result
-from easy_api.service.pipeline import wrap_task, run
+from easy_api.service.pipeline import wrap_task, run, get_dependencies, execute_inline_template, \
+    compile_inline_template
 
 
 def async_echo(v):
@@ -23,6 +25,24 @@ def async_require_arguments(v: Result):
     return _
 
 
+@pytest.mark.parametrize(["text", "context", "expect"], (
+        ("{{ result.data }}", {"result": {"data": [{"name": "Duo"}]}}, [{"name": "Duo"}]),
+        ("{{ result.data }}", {"result": {"data": "42"}}, "42"),
+        ("{{ result.data }}", {"result": {"data": "hello Duo"}}, "hello Duo"),
+        ("{{ result.data.num + 1 }}", {"result": {"data": {"num": 1}}}, 2),
+        ("{{ missing }}", {}, ""),
+        ('"I am {{ name }}"', {"name": "Duo"}, "I am Duo"),
+        ("{{ a }}{{ b }}", {"a": 4, "b": 2}, 42),
+        ("", {}, ""),
+))
+def test_execute_inline_template(text, context, expect):
+    assert execute_inline_template(text, context) == expect
+
+
+def test_compile_inline_template_once():
+    assert compile_inline_template("{{ result.data.name }}") is compile_inline_template("{{ result.data.name }}")
+
+
 @pytest.mark.parametrize(["data", "output", "expect", "message"], (
         ({"name": "Duo", "age": 18}, {"name": "{{ result.data.name }}"}, {"name": "Duo"}, "dict"),
 ))
@@ -65,6 +85,246 @@ async def test_run(task_configs, expect, message):
         assert result == expect, message
 
 
+async def test_run_without_layer_cap():
+    task_configs = [TaskSchema("", "", {"num": 0} if i == 0 else {}, output={"num": "{{ result.data.num + 1 }}"},
+                               layer=i) for i in range(8)]
+    with patch("easy_api.service.pipeline.get_task_by_name") as mock:
+        mock.return_value = async_require_arguments(Result.success({}))
+        assert await run(task_configs) == {"num": 8}
+
+
+async def test_run_task_once_dependencies_finished():
+    events = []
+
+    def get_task(package_name, name):
+        async def _(**kwargs):
+            events.append(f"start {name}")
+            await asyncio.sleep(0.05 if name == "slow" else 0)
+            events.append(f"finish {name}")
+            return Result.success(kwargs)
+
+        return _
+
+    task_configs = [
+        TaskSchema("", "slow", {"a": 1}, output={"a": "{{ result.data.a }}"}, id="slow"),
+        TaskSchema("", "fast", {"b": 2}, output={"b": "{{ result.data.b }}"}, id="fast"),
+        TaskSchema("", "next", {}, output={"c": "{{ result.data.b }}"}, layer=1, depends=["fast"]),
+    ]
+    with patch("easy_api.service.pipeline.get_task_by_name", side_effect=get_task):
+        result = await run(task_configs)
+
+    assert events.index("finish next") < events.index("finish slow")
+    assert result == {"a": 1, "c": 2}
+
+
+def test_dependencies_of_previous_layer():
+    task_configs = [
+        TaskSchema("", "echo", {"num": 1}, output={"val1": "{{ result.data }}"}, id="a"),
+        TaskSchema("", "echo", {"num": 2}, output={"val2": "{{ result.data }}"}),
+        TaskSchema("", "sum", {}, output={"total": "{{ result.data }}"}, layer=1),
+        TaskSchema("", "sum", {}, output={"total": "{{ result.data }}"}, layer=1, depends=["a"]),
+        TaskSchema("", "any", {}, output={}, layer=3),
+    ]
+    assert get_dependencies(task_configs) == [[], [], [0, 1], [0], [2, 3]]
+
+
+async def test_run_keeps_layer_context():
+    async def task_c(x, **kwargs):
+        return Result.success(sorted(kwargs))
+
+    task_configs = [
+        TaskSchema("", "a", {"x": 1}, output={"x": "{{ result.data.x }}"}),
+        TaskSchema("", "b", {"y": 2}, output={"y": "{{ result.data.y }}"}),
+        TaskSchema("", "c", {}, output={"z": "{{ result.data }}"}, layer=1),
+    ]
+    with patch("easy_api.service.pipeline.get_task_by_name",
+               side_effect=lambda package_name, name: task_c if name == "c" else async_require_arguments(
+                   Result.success({}))):
+        assert await run(task_configs) == {"z": ["y"]}
+
+
+def test_invalid_dependencies():
+    with pytest.raises(ValueError):
+        get_dependencies([TaskSchema("", "", {}, output={}, depends=["missing"])])
+
+    with pytest.raises(ValueError):
+        get_dependencies([TaskSchema("", "", {}, output={}, id="a"), TaskSchema("", "", {}, output={}, id="a")])
+
+
+async def test_run_with_cycle():
+    task_configs = [
+        TaskSchema("", "", {}, output={}, id="a", depends=["b"]),
+        TaskSchema("", "", {}, output={}, id="b", depends=["a"]),
+    ]
+    with pytest.raises(ValueError):
+        await run(task_configs)
+
+
+async def test_run_with_concurrency():
+    running = 0
+    max_running = 0
+
+    async def task(**kwargs):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return Result.success(kwargs)
+
+    task_configs = [TaskSchema("", "", {"i": i}, output={f"out{i}": "{{ result.data.i }}"}) for i in range(6)]
+    with patch("easy_api.service.pipeline.get_task_by_name") as mock:
+        mock.return_value = task
+        result = await run(task_configs, concurrency=2)
+
+    assert result == {f"out{i}": i for i in range(6)}
+    assert max_running == 2
+
+
+async def test_run_with_trace():
+    async def task(**kwargs):
+        await asyncio.sleep(0.01)
+        return Result.success(kwargs)
+
+    task_configs = [
+        TaskSchema("demo", "echo", {"num": 1}, output={"num": "{{ result.data.num }}"}, id="echo"),
+        TaskSchema("demo", "echo", {}, output={"skipped": "{{ result.data }}"}, condition="{{ num > 1 }}", layer=1),
+        TaskSchema("demo", "echo", {}, output={"total": "{{ result.data.num + 1 }}"}, layer=1),
+    ]
+    trace = []
+    with patch("easy_api.service.pipeline.get_task_by_name") as mock:
+        mock.return_value = task
+        assert await run(task_configs, trace=trace) == {"total": 2}
+
+    assert [(x["id"], x["depends"], x["status"]) for x in trace] == [
+        ("echo", [], "success"), ("1", ["echo"], "skipped"), ("2", ["echo"], "success")]
+    echo, skipped, total = trace
+    assert echo["task"] == "demo.echo"
+    assert echo["execute_seconds"] >= 0.01
+    assert echo["result_size"] == len(b'{"code":0,"msg":"","data":{"num":1}}')
+    assert skipped["started"] is None
+    assert echo["finished"] <= total["queued"] <= total["started"] < total["finished"]
+
+
+def stream_rows(count: int, events: list = None):
+    async def run_stream(data: dict = None, batch_size: int = 1000, **__):
+        for start in range(0, count, batch_size):
+            if events is not None:
+                events.append(f"read {start}")
+            yield [{"id": i} for i in range(start, min(start + batch_size, count))]
+
+    return run_stream
+
+
+async def test_run_with_stream():
+    events = []
+    running = 0
+    max_running = 0
+
+    async def task(rows, **__):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        events.append(f"process {rows[0]['id']}")
+        await asyncio.sleep(0.01 if rows[0]["id"] == 0 else 0)
+        running -= 1
+        return Result.success(len(rows))
+
+    task_configs = [TaskSchema("", "count", {}, output={"counts": "{{ result.data }}"},
+                               stream=StreamSchema("", "rows", batch_size=3, concurrency=2))]
+    with patch("easy_api.service.pipeline.get_task_by_name") as mock, \
+            patch("easy_api.service.pipeline.get_stream_by_name") as stream_mock:
+        mock.return_value = task
+        stream_mock.return_value = stream_rows(10, events)
+        result = await run(task_configs)
+
+    assert result == {"counts": [3, 3, 3, 1]}
+    assert max_running == 2
+    # only one chunk is read ahead of the running chunks
+    assert events.index("read 9") > events.index("process 3")
+
+
+async def test_run_with_stream_fail():
+    calls = []
+
+    async def task(rows, **__):
+        calls.append(rows[0]["id"])
+        return Result.failre("bad rows") if rows[0]["id"] == 0 else Result.success(len(rows))
+
+    task_configs = [TaskSchema("", "count", {}, output={"counts": "{{ result.data }}"},
+                               stream=StreamSchema("", "rows", batch_size=1, concurrency=1))]
+    with patch("easy_api.service.pipeline.get_task_by_name") as mock, \
+            patch("easy_api.service.pipeline.get_stream_by_name") as stream_mock:
+        mock.return_value = task
+        stream_mock.return_value = stream_rows(100)
+        result = await run(task_configs)
+
+    assert result == {"counts_error": Result.failre("bad rows")}
+    assert calls == [0]
+
+
+async def test_run_with_stream_raise():
+    calls = []
+
+    async def task(rows, **__):
+        calls.append(rows[0]["id"])
+        await asyncio.sleep(0)
+        raise TypeError("broken worker")
+
+    task_configs = [TaskSchema("", "count", {}, output={"counts": "{{ result.data }}"},
+                               stream=StreamSchema("", "rows", batch_size=1, concurrency=2))]
+    with patch("easy_api.service.pipeline.get_task_by_name") as mock, \
+            patch("easy_api.service.pipeline.get_stream_by_name") as stream_mock:
+        mock.return_value = task
+        stream_mock.return_value = stream_rows(50)
+        with pytest.raises(TypeError):
+            await run(task_configs)
+
+    assert len(calls) <= 3
+
+
+@pytest.mark.parametrize(["batch_size", "expect_calls"], ((1, 5), (2, 3)))
+async def test_run_with_map(batch_size, expect_calls):
+    calls = []
+    running = 0
+    max_running = 0
+
+    async def echo(**kwargs):
+        return Result.success(kwargs)
+
+    async def square(item, **__):
+        nonlocal running, max_running
+        calls.append(item)
+        running += 1
+        max_running = max(max_running, running)
+        # the earlier items finish later
+        await asyncio.sleep(0.01 * (5 - len(calls)))
+        running -= 1
+        return Result.success([x * x for x in item] if isinstance(item, list) else item * item)
+
+    task_configs = [
+        TaskSchema("", "echo", {"nums": [1, 2, 3, 4, 5]}, output={"nums": "{{ result.data.nums }}"}),
+        TaskSchema("", "square", {}, output={"squares": "{{ result.data }}"}, layer=1,
+                   map=MapSchema("{{ nums }}", batch_size=batch_size, concurrency=2)),
+    ]
+    with patch("easy_api.service.pipeline.get_task_by_name",
+               side_effect=lambda package_name, name: square if name == "square" else echo):
+        assert get_dependencies(task_configs) == [[], [0]]
+        result = await run(task_configs)
+
+    assert result == {"squares": [1, 4, 9, 16, 25]}
+    assert len(calls) == expect_calls
+    assert max_running == 2
+
+
+async def test_run_with_map_not_list():
+    task_configs = [TaskSchema("", "", {}, output={"out": "{{ result.data }}"}, map=MapSchema("{{ missing }}"))]
+    with patch("easy_api.service.pipeline.get_task_by_name") as mock:
+        mock.return_value = async_echo(1)
+        with pytest.raises(ValueError):
+            await run(task_configs)
+
+
 # @pytest.mark.parametrize(["task_configs", "data", "expect", "message"], (
 #         ([
 #              TaskSchema("", "", {"sex": "don't care"}, output={"sex": "v(result)"}, layer=0),
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+
+import pytest
+
+from easy_api.service.publisher import Publisher
+
+
+class FakeProducer:
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def release(self):
+        self.pool.released += 1
+
+
+class FakeProducerPool:
+
+    def __init__(self):
+        self.acquired = 0
+        self.released = 0
+
+    def acquire(self, block=True):
+        self.acquired += 1
+        return FakeProducer(self)
+
+
+class FakeApp:
+
+    def __init__(self):
+        self.producer_pool = FakeProducerPool()
+
+
+class FakeTask:
+    name = "fake_task"
+
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, args=None, kwargs=None, producer=None, **options):
+        assert threading.current_thread().name == "easy_api_publisher"
+        if args and args[0] == "broken":
+            raise ConnectionError("broken")
+        self.calls.append((args, options, producer))
+        return options.get("task_id")
+
+
+async def test_publish_in_order():
+    app = FakeApp()
+    publisher = Publisher(app)
+    task = FakeTask()
+    sending = threading.Event()
+    release = threading.Event()
+
+    class BlockedTask(FakeTask):
+        def apply_async(self, args=None, kwargs=None, producer=None, **options):
+            sending.set()
+            release.wait()
+            return super().apply_async(args, kwargs, producer, **options)
+
+    try:
+        # the first task is sent at once, the others are queued while it is sending
+        first = publisher.publish(BlockedTask(), ["first"], task_id="first")
+        await asyncio.get_running_loop().run_in_executor(None, sending.wait)
+        futures = [publisher.publish(task, [i], task_id=str(i)) for i in range(20)]
+        release.set()
+        results = await asyncio.gather(first, *futures)
+    finally:
+        publisher.stop()
+
+    assert results == ["first"] + [str(i) for i in range(20)]
+    assert [x[0] for x in task.calls] == [[i] for i in range(20)]
+    # all tasks are sent by the same persistent producer
+    assert len({id(x[2]) for x in task.calls}) == 1
+    assert publisher.stats()["published"] == 21
+    assert app.producer_pool.acquired == app.producer_pool.released == 1
+
+
+async def test_publish_error():
+    app = FakeApp()
+    publisher = Publisher(app)
+    task = FakeTask()
+    try:
+        with pytest.raises(ConnectionError):
+            await publisher.publish(task, ["broken"])
+        assert await publisher.publish(task, ["ok"], task_id="ok") == "ok"
+    finally:
+        publisher.stop()
+
+    assert publisher.stats()["errors"] == 1
+    assert app.producer_pool.acquired == 2
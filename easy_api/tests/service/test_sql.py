@@ -1,4 +1,5 @@
 import asyncio
+import importlib
 import os.path
 import shutil
 
@@ -8,7 +9,7 @@ from easy_api import configs
 from easy_api.errors import SQLExistsError
 from easy_api.schema import get_json_schema
 from easy_api.service.package import create_package
-from easy_api.service.sql import create_sql, delete_sql
+from easy_api.service.sql import create_sql, delete_sql, create_pagination_sql
 from easy_api.tests.utils import assert_folders_same
 
 
@@ -66,3 +67,43 @@ async def test_delete_sql(tmp_package):
     assert not os.path.exists(os.path.join(configs.project_root, tmp_package, "service", f"{sql_name}_sql.py"))
     assert not os.path.exists(
         os.path.join(configs.project_root, tmp_package, "service", "sql_template", f"{sql_name}.sql.jinja"))
+
+
+@pytest.mark.usefixtures("setup_sqlite")
+async def test_keyset_pagination_sql(tmp_package):
+    sql_name = "keyset_names"
+    await create_pagination_sql(tmp_package, sql_name, sql_name, sql_jinja="select name, age from easy_api_test",
+                                count_jinja=True, database="sqlite", overwrite=True, keyset="age desc, name desc")
+    importlib.invalidate_caches()
+    service = importlib.import_module(f"{tmp_package}.service.{sql_name}")
+
+    pages = []
+    cursor = None
+    while True:
+        result = await service.run({"page_size": 3, "cursor": cursor})
+        assert result.code == 0, result.msg
+        assert result.count == 4
+        pages.append([x["name"] for x in result.data])
+        cursor = result.next_cursor
+        if cursor is None:
+            break
+
+    assert pages == [["Mary", "Peter", "Wick"], ["John"]]
+
+
+@pytest.mark.usefixtures("setup_sqlite")
+@pytest.mark.parametrize(["count_mode", "expected_count"], [("exact", 4), ("estimate", 4), ("none", -1)])
+async def test_pagination_sql_count_mode(tmp_package, count_mode, expected_count):
+    sql_name = f"{count_mode}_count_names"
+    await create_pagination_sql(tmp_package, sql_name, sql_name, sql_jinja="select name, age from easy_api_test",
+                                count_jinja=True, database="sqlite", overwrite=True, count_mode=count_mode,
+                                count_ttl=60)
+    importlib.invalidate_caches()
+    service = importlib.import_module(f"{tmp_package}.service.{sql_name}")
+
+    result = await service.run({"page": 1, "page_size": 3})
+    assert result.code == 0, result.msg
+    assert (len(result.data), result.count, result.has_more) == (3, expected_count, True)
+
+    result = await service.run({"page": 2, "page_size": 3})
+    assert (len(result.data), result.count, result.has_more) == (1, expected_count, False)
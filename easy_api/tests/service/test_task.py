@@ -0,0 +1,196 @@
+import asyncio
+import time
+
+import pytest
+
+from easy_api import tasks
+from easy_api.errors import TaskTimeoutError
+from easy_api.schema import Result
+from easy_api.service import cache, task
+from easy_api.service.task import TaskCache, run_in_celery, run_in_worker
+
+
+class FakeWaiter:
+
+    def __init__(self, broken: bool = False):
+        self.broken = broken
+        self.waiter = {}
+        self.forgotten = []
+        self.stats = {"timeouts": 0, "cancellations": 0}
+        self.reply_to = None
+
+    async def wait_result(self, task_id, future):
+        self.waiter[task_id] = future
+        if self.broken:
+            raise ConnectionError("subscribe error")
+
+    async def forget(self, task_id):
+        self.waiter.pop(task_id, None)
+        self.forgotten.append(task_id)
+
+
+@pytest.fixture
+def waiter(monkeypatch):
+    fake = FakeWaiter()
+    monkeypatch.setattr(task, "celery_waiter", fake)
+    return fake
+
+
+@pytest.fixture
+def revoked(monkeypatch):
+    revoked = []
+    monkeypatch.setattr(task, "revoke_task", revoked.append)
+    return revoked
+
+
+def fake_publish(waiter: FakeWaiter, result=None, sent: list = None):
+    async def publish(invoke_task, args=None, task_id=None, **options):
+        if sent is not None:
+            sent.append((args, task_id, options))
+        if result is not None:
+            waiter.waiter[task_id].set_result(result)
+
+    return publish
+
+
+async def test_run_in_celery(waiter, revoked, monkeypatch):
+    sent = []
+    monkeypatch.setattr(task, "publish", fake_publish(waiter, {"code": 0, "msg": "", "data": 42}, sent))
+
+    result = await run_in_celery("demo", "hello", ("Duo",), {}, 10)
+    assert result == {"code": 0, "msg": "", "data": 42}
+    (args, task_id, options), = sent
+    assert args == ["demo", "hello", ("Duo",), {}]
+    assert options["expires"] == 10
+    assert waiter.forgotten == [task_id]
+    assert waiter.waiter == {}
+    assert revoked == []
+
+
+async def test_run_in_celery_timeout(waiter, revoked, monkeypatch):
+    sent = []
+    monkeypatch.setattr(task, "publish", fake_publish(waiter, sent=sent))
+
+    with pytest.raises(asyncio.TimeoutError):
+        await run_in_celery("demo", "hello", (), {}, 0.01)
+
+    task_id = sent[0][1]
+    assert revoked == [task_id]
+    assert waiter.forgotten == [task_id]
+    assert waiter.stats["timeouts"] == 1
+
+
+async def test_run_in_celery_cancelled(waiter, revoked, monkeypatch):
+    sent = []
+    monkeypatch.setattr(task, "publish", fake_publish(waiter, sent=sent))
+
+    future = asyncio.ensure_future(run_in_celery("demo", "hello", (), {}, 10))
+    await asyncio.sleep(0.01)
+    future.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await future
+
+    task_id = sent[0][1]
+    assert revoked == [task_id]
+    assert waiter.forgotten == [task_id]
+    assert waiter.stats["cancellations"] == 1
+
+
+async def test_run_in_celery_subscribe_error(revoked, monkeypatch):
+    waiter = FakeWaiter(broken=True)
+    monkeypatch.setattr(task, "celery_waiter", waiter)
+    sent = []
+    monkeypatch.setattr(task, "publish", fake_publish(waiter, sent=sent))
+
+    with pytest.raises(ConnectionError):
+        await run_in_celery("demo", "hello", (), {}, 10)
+
+    assert sent == []
+    assert len(waiter.forgotten) == 1
+    assert waiter.waiter == {}
+
+
+@pytest.fixture
+def worker_task(monkeypatch):
+    """ register a function decorated by run_in_worker, it runs in the thread executor """
+    calls = []
+
+    def register(name: str, result_of, **options):
+        @run_in_worker("test_package", name, executor="thread", **options)
+        def _(value, delay: float = 0, **__):
+            calls.append(value)
+            time.sleep(delay)
+            return result_of(value)
+
+        monkeypatch.setitem(tasks.registry, ("test_package", name), _)
+        return _
+
+    register.calls = calls
+    return register
+
+
+async def test_run_in_worker_cache(worker_task):
+    await cache.get_backend().clear()
+    job = worker_task("cached_echo", Result.success, task_cache=60)
+    stats = dict(task.get_task_cache_stats())
+
+    assert await job("Duo") == Result.success("Duo")
+    assert await job("Duo") == Result.success("Duo")
+    assert await job("Bing") == Result.success("Bing")
+    assert worker_task.calls == ["Duo", "Bing"]
+    assert task.get_task_cache_stats()["hits"] - stats["hits"] == 1
+    assert task.get_task_cache_stats()["misses"] - stats["misses"] == 2
+
+
+async def test_run_in_worker_not_cache_failure(worker_task):
+    await cache.get_backend().clear()
+    job = worker_task("cached_failure", lambda value: Result.failre(f"bad {value}"), task_cache=60)
+
+    assert (await job("Duo")).msg == "bad Duo"
+    assert (await job("Duo")).msg == "bad Duo"
+    assert worker_task.calls == ["Duo", "Duo"]
+
+
+async def test_run_in_worker_share_flight(worker_task):
+    await cache.get_backend().clear()
+    job = worker_task("cached_slow", Result.success, task_cache=TaskCache(ttl=60, key=lambda value, **__: value))
+
+    results = await asyncio.gather(*[job("Duo", delay=0.05 * (i + 1)) for i in range(3)])
+    assert results == [Result.success("Duo")] * 3
+    assert worker_task.calls == ["Duo"]
+
+
+async def test_run_in_worker_without_cache(worker_task):
+    job = worker_task("not_cached", Result.success, task_cache=0)
+
+    assert await job("Duo") == Result.success("Duo")
+    assert await job("Duo") == Result.success("Duo")
+    assert worker_task.calls == ["Duo", "Duo"]
+
+    with pytest.raises(ValueError):
+        run_in_worker("test_package", "not_cached", task_cache=True)
+
+
+async def test_run_in_thread_executor(worker_task):
+    job = worker_task("thread_echo", Result.success)
+    assert await job("Duo") == Result.success("Duo")
+    assert worker_task.calls == ["Duo"]
+
+
+async def test_run_in_executor_timeout(worker_task):
+    job = worker_task("thread_slow", Result.success, timeout=0.01)
+    result = await job("Duo", delay=0.2)
+    assert result.code == TaskTimeoutError.code
+    assert "test_package.thread_slow" in result.msg
+
+
+def test_get_executor(monkeypatch):
+    monkeypatch.setattr(task, "executors", {})
+    try:
+        assert task.get_executor("thread") is task.get_executor("thread")
+        # the process workers are spawned, fork is not safe in the server with threads
+        assert task.get_executor("process")._mp_context.get_start_method() == "spawn"
+        with pytest.raises(ValueError):
+            task.get_executor("unknown")
+    finally:
+        task.shutdown_executors()
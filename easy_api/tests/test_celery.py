@@ -0,0 +1,50 @@
+import dataclasses
+
+import pytest
+
+from easy_api import celery, configs
+from easy_api.tasks import invoke_task
+
+
+@pytest.fixture(params=["redis://localhost:6379/0", "amqp://guest@localhost//"])
+def broker(request):
+    return request.param
+
+
+@pytest.fixture
+def routes(broker):
+    origin = configs.celery
+    configs.celery = dataclasses.replace(origin, broker=broker, routes={
+        "report": {"queue": "slow"},
+        "report.daily": {"queue": "slow", "priority": 0},
+    })
+    celery.install()
+    try:
+        yield
+    finally:
+        configs.celery = origin
+        celery.install()
+
+
+@pytest.mark.usefixtures("routes")
+@pytest.mark.parametrize(["package_name", "task_name", "queue", "priority"], (
+        ("report", "daily", "slow", 0),
+        ("report", "weekly", "slow", None),
+        ("demo", "hello", "celery", None),
+))
+def test_route_task(broker, package_name, task_name, queue, priority):
+    options = celery.app.amqp.router.route({}, invoke_task.name, [package_name, task_name, [], {}])
+    assert options["queue"].name == queue
+    if priority is not None and broker.startswith("amqp"):
+        # rabbitmq serves the larger number first
+        priority = 9 - priority
+    assert options.get("priority") == priority
+
+
+@pytest.mark.usefixtures("routes")
+def test_transport_options(broker):
+    options = celery.app.conf.broker_transport_options
+    if broker.startswith("redis"):
+        assert options["queue_order_strategy"] == "priority"
+    else:
+        assert "queue_order_strategy" not in options
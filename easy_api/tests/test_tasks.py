@@ -0,0 +1,35 @@
+import types
+
+from easy_api import tasks
+
+
+def test_load_registry():
+    tasks.registry.clear()
+    tasks.modules.clear()
+    tasks.import_seconds.clear()
+    tasks.load_registry()
+
+    # the apps of test config is easy_api, its pipeline service has a run function
+    from easy_api.service import pipeline
+    assert tasks.registry[("easy_api", "pipeline")] is pipeline.run
+    assert tasks.get_task_by_name("easy_api", "pipeline") is pipeline.run
+    assert "easy_api.service.pipeline" in tasks.get_registry_stats()["import_seconds"]
+
+
+def test_get_stream_by_name(monkeypatch):
+    imported = []
+
+    def import_module(name):
+        imported.append(name)
+        return types.SimpleNamespace(run=lambda: None, run_stream=lambda: None)
+
+    monkeypatch.setattr(tasks, "import_module", import_module)
+    monkeypatch.setattr(tasks, "registry", {})
+    monkeypatch.setattr(tasks, "modules", {})
+    monkeypatch.setattr(tasks, "import_seconds", {})
+
+    run_stream = tasks.get_stream_by_name("demo", "users")
+    # the module is imported once, then the stream and the task are got from the registry
+    assert tasks.get_stream_by_name("demo", "users") is run_stream
+    assert tasks.get_task_by_name("demo", "users") is not None
+    assert imported == ["demo.service.users"]
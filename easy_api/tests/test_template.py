@@ -2,7 +2,7 @@ import os
 
 import pytest
 
-from easy_api.service.template import render_template, render_string
+from easy_api.service.template import render_template, render_string, compile_template
 
 file_dir = os.path.dirname(os.path.realpath(__file__))
 template_dir = os.path.join(file_dir, 'template')
@@ -38,3 +38,20 @@ async def test_render_string_with_like():
     query, bin_params = await render_string(content, {'like_name': '%world%'})
     assert query == "select * from some_table where name like ?"
     assert bin_params == ['%world%']
+
+
+async def test_render_string_with_compiled_cache():
+    content = "select * from cache_table where name = {{ name }}"
+    compile_template.cache_clear()
+
+    query, bin_params = await render_string(content, {'name': 'world'})
+    assert query == "select * from cache_table where name = ?"
+    assert bin_params == ['world']
+
+    query, bin_params = await render_string(content, {'name': 'tom'})
+    assert query == "select * from cache_table where name = ?"
+    assert bin_params == ['tom']
+
+    cache_info = compile_template.cache_info()
+    assert cache_info.misses == 1
+    assert cache_info.hits == 1
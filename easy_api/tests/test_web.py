@@ -0,0 +1,109 @@
+import asyncio
+from abc import ABC
+from dataclasses import asdict
+
+import orjson
+import pytest
+import tornado.iostream
+import tornado.tcpclient
+import tornado.web
+
+from easy_api.schema import SqlResult
+from easy_api.web import Handler
+
+
+async def batches(*items):
+    for rows in items:
+        yield rows
+
+
+async def broken_batches():
+    raise ValueError("broken")
+    yield []
+
+
+class StreamHandler(Handler, ABC):
+
+    async def get(self, name: str):
+        if name == "rows":
+            stream = batches([{"name": "Duo"}, {"name": "Bing"}], [], [{"name": "Tom"}])
+        elif name == "empty":
+            stream = batches()
+        else:
+            stream = broken_batches()
+
+        try:
+            await self.write_json_stream(stream, SqlResult.success(None, 0))
+        except Exception as e:
+            self.write(SqlResult.error(e))
+
+
+class SlowHandler(Handler, ABC):
+    cancel_on_close = True
+    started = None
+    cancelled = None
+    finished = None
+
+    async def get(self):
+        self.started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        self.finished.set()
+
+
+class FileHandler(SlowHandler, ABC):
+    cancel_on_close = False
+
+    async def get(self):
+        self.started.set()
+        await asyncio.sleep(0.1)
+        self.finished.set()
+
+
+@pytest.fixture
+def app():
+    return tornado.web.Application([
+        (r"/stream/(\w+)", StreamHandler),
+        (r"/slow", SlowHandler),
+        (r"/file", FileHandler),
+    ])
+
+
+@pytest.mark.parametrize(["name", "expect"], (
+        ("rows", SqlResult.success([{"name": "Duo"}, {"name": "Bing"}, {"name": "Tom"}], 0)),
+        ("empty", SqlResult.success([], 0)),
+        ("broken", SqlResult.error(ValueError("broken"))),
+))
+async def test_write_json_stream(http_server_client, name, expect):
+    response = await http_server_client.fetch(f'/stream/{name}')
+    assert response.code == 200
+    assert orjson.loads(response.body) == asdict(expect)
+
+
+async def test_cancel_request_on_connection_close(http_server, http_server_port):
+    SlowHandler.started = asyncio.Event()
+    SlowHandler.cancelled = asyncio.Event()
+
+    stream = await tornado.tcpclient.TCPClient().connect("127.0.0.1", http_server_port[1])
+    await stream.write(b"GET /slow HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    await asyncio.wait_for(SlowHandler.started.wait(), 5)
+    stream.close()
+
+    await asyncio.wait_for(SlowHandler.cancelled.wait(), 5)
+
+
+async def test_not_cancel_request_by_default(http_server, http_server_port):
+    FileHandler.started = asyncio.Event()
+    FileHandler.cancelled = asyncio.Event()
+    FileHandler.finished = asyncio.Event()
+
+    stream = await tornado.tcpclient.TCPClient().connect("127.0.0.1", http_server_port[1])
+    await stream.write(b"GET /file HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    await asyncio.wait_for(FileHandler.started.wait(), 5)
+    stream.close()
+
+    await asyncio.wait_for(FileHandler.finished.wait(), 5)
+    assert not FileHandler.cancelled.is_set()
@@ -1,7 +1,8 @@
+import asyncio
 import logging
 from abc import ABC
 from dataclasses import asdict
-from typing import Union
+from typing import Union, AsyncIterator
 
 import orjson
 import tornado.web
@@ -13,6 +14,29 @@ logger = logging.getLogger("easy_api.web")
 
 
 class Handler(tornado.web.RequestHandler, ABC):
+    # cancel the request when the client is disconnected, only the handlers which wait the queries or tasks
+    # set it, the others like generating files must not stop halfway
+    cancel_on_close: bool = False
+    _request_task: asyncio.Task = None
+    _cancelled: bool = False
+
+    async def _execute(self, *args, **kwargs):
+        self._request_task = asyncio.current_task()
+        try:
+            return await super()._execute(*args, **kwargs)
+        except asyncio.CancelledError:
+            if not self._cancelled:
+                raise
+            logger.debug("request is cancelled since the client is disconnected: %s", self.request.uri)
+
+    def on_connection_close(self) -> None:
+        """ cancel the request when the client is disconnected if cancel_on_close, so the waited tasks are revoked """
+        super().on_connection_close()
+        if not self.cancel_on_close:
+            return
+        if self._request_task is not None and not self._request_task.done() and not self._finished:
+            self._cancelled = True
+            self._request_task.cancel()
 
     def write(self, chunk: Union[str, bytes, dict, JsonSchemaMixin]) -> None:
         if self._finished:
@@ -34,3 +58,38 @@ class Handler(tornado.web.RequestHandler, ABC):
             raise TypeError(message)
         chunk = utf8(chunk)
         self._write_buffer.append(chunk)
+
+    async def write_json_stream(self, batches: AsyncIterator[list], result: JsonSchemaMixin) -> None:
+        """
+        Write the result as json, the rows of result.data are written from batches
+        and flushed after each batch, so the whole data never be held in memory.
+
+        The error raised before the first batch is raised directly and nothing is written.
+
+        :param batches: the async iterator of the row batches
+        :param result: the result with data is None
+        """
+        iterator = batches.__aiter__()
+        try:
+            rows = await iterator.__anext__()
+        except StopAsyncIteration:
+            rows = []
+
+        head, tail = orjson.dumps(asdict(result)).split(b'"data":null', 1)
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self._write_buffer.append(head + b'"data":[')
+        self._write_buffer.append(orjson.dumps(rows)[1:-1])
+        is_empty = not rows
+        try:
+            await self.flush()
+            async for rows in iterator:
+                if not rows:
+                    continue
+                chunk = orjson.dumps(rows)[1:-1]
+                self._write_buffer.append(chunk if is_empty else b"," + chunk)
+                is_empty = False
+                await self.flush()
+        except Exception:
+            logger.exception("write json stream error")
+            raise
+        self._write_buffer.append(b"]" + tail)